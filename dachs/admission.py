@@ -0,0 +1,97 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import math
+import threading
+
+import metrics
+
+DEFAULT_MAX_PENDING_REQUESTS = 256
+
+#limits the number of requests the server has accepted but not yet answered,
+#globally and per target group, a matrix request counts once per group
+class AdmissionControl:
+    def __init__(self, targetConfig, maxPending = DEFAULT_MAX_PENDING_REQUESTS, maxQueuedPerGroup = None):
+        self.targetConfig = targetConfig
+        self.maxPending = maxPending
+        self.maxQueuedPerGroup = maxQueuedPerGroup
+        self.lock = threading.Lock()
+        self.numPending = 0
+        self.pendingPerGroup = {}
+        
+    #returns None if the requests for the groups are admitted, the reason for
+    #the rejection otherwise, admitted requests have to be released
+    def admit(self, groupKeys):
+        with self.lock:
+            if self.numPending + len(groupKeys) > self.maxPending:
+                reason = "server busy"
+            else:
+                reason = None
+                for key in groupKeys:
+                    if self.maxQueuedPerGroup != None and self.pendingPerGroup.get(key, 0) >= self._numBoards(key) + self.maxQueuedPerGroup:
+                        reason = "queue of " + key[0] + "/" + key[1] + " full"
+                        break
+            if reason == None:
+                self.numPending += len(groupKeys)
+                for key in groupKeys:
+                    self.pendingPerGroup[key] = self.pendingPerGroup.get(key, 0) + 1
+            numPending = self.numPending
+                
+        metrics.METRICS.setGauge("dachs_pending_requests", numPending)
+        if reason != None:
+            metrics.METRICS.increment("dachs_admission_rejections_total", reason = "global" if reason == "server busy" else "group")
+        return reason
+    
+    def release(self, groupKeys):
+        with self.lock:
+            self.numPending -= len(groupKeys)
+            for key in groupKeys:
+                self.pendingPerGroup[key] -= 1
+            numPending = self.numPending
+        metrics.METRICS.setGauge("dachs_pending_requests", numPending)
+        
+    #seconds until a new request for the groups would be served, None if the
+    #run history knows no run times for one of them
+    def estimateWait(self, groupKeys):
+        history = self.targetConfig.history
+        if not history:
+            return None
+        wait = 0
+        for key in groupKeys:
+            runTime = history.averageRunTime(key[0], key[1])
+            if runTime == None:
+                return None
+            numBoards = self._numBoards(key)
+            with self.lock:
+                numAhead = self.pendingPerGroup.get(key, 0)
+            wait = max(wait, math.ceil(max(numAhead - numBoards + 1, 0) / numBoards) * runTime)
+        return int(math.ceil(wait))
+    
+    def _numBoards(self, key):
+        try:
+            return len(self.targetConfig.getTargetHandlerGroup(key).sectionNames)
+        except KeyError:
+            return 1
@@ -0,0 +1,236 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import io
+import mmap
+import tempfile
+import threading
+import time
+
+#bytes all artifacts of a store may keep in memory before new data goes to disk
+DEFAULT_MEMORY_LIMIT = 67108864
+CHUNK_SIZE = 65536
+
+#reads an artifact held in memory without copying it first
+class BufferReader:
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+        self.closed = False
+        
+    def read(self, size = -1):
+        if size < 0:
+            size = len(self.view) - self.position
+        data = self.view[self.position:self.position + size].tobytes()
+        self.position += len(data)
+        return data
+    
+    #tftpy seeks to the end to learn the size for the tsize option
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(offset, 0)
+        return self.position
+    
+    def tell(self):
+        return self.position
+    
+    def close(self):
+        self.closed = True
+        self.view.release()
+        self.view = memoryview(b"")
+        
+        
+#data passed between the stages of a request, e.g. the executable or the image
+#of a board, it is written once and read afterwards, in memory as long as the
+#store has room for it and in a file in the store's directory otherwise
+class Artifact:
+    def __init__(self, store, suffix = "", fileObject = None):
+        self.store = store
+        self.suffix = suffix
+        self.buffer = bytearray()
+        self.reserved = 0
+        self.fileObject = fileObject
+        self.mmap = None
+        self.size = 0
+        #readers of a shared artifact, e.g. of a matrix request, may move it to disk concurrently
+        self.lock = threading.Lock()
+        
+    def write(self, data):
+        if self.fileObject == None and not self.store._reserve(len(data)):
+            self._spill()
+        if self.fileObject != None:
+            self.fileObject.write(data)
+        else:
+            self.buffer += data
+            self.reserved += len(data)
+        self.size += len(data)
+        
+    def isSpooled(self):
+        return self.fileObject != None
+    
+    #a memoryview of the content, mapped from the file if the artifact was spooled
+    def getbuffer(self):
+        if self.fileObject == None:
+            return memoryview(self.buffer)
+        if self.size == 0:
+            return memoryview(b"")
+        with self.lock:
+            if self.mmap == None:
+                self.fileObject.flush()
+                self.mmap = mmap.mmap(self.fileObject.fileno(), 0, access = mmap.ACCESS_READ)
+            return memoryview(self.mmap)
+    
+    #readers share the buffer, or the mapping of the file, instead of reading a copy each
+    def open(self):
+        return BufferReader(self.getbuffer())
+    
+    #the name of a file holding the content, for external tools, the artifact
+    #is moved to disk for this
+    def path(self):
+        with self.lock:
+            if self.fileObject == None:
+                self._spill()
+            self.fileObject.flush()
+            return self.fileObject.name
+    
+    def _spill(self):
+        self.fileObject = tempfile.NamedTemporaryFile(suffix = self.suffix, dir = self.store.directory)
+        self.fileObject.write(self.buffer)
+        self.buffer = bytearray()
+        self.store._release(self.reserved)
+        self.reserved = 0
+        
+    def close(self):
+        self.store._release(self.reserved)
+        self.reserved = 0
+        self.buffer = bytearray()
+        if self.mmap != None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                #a reader still uses the mapping, it is closed once it is released
+                pass
+            self.mmap = None
+        if self.fileObject != None:
+            self.fileObject.close()
+            
+    def __len__(self):
+        return self.size
+    
+    
+#an artifact shared by all requests deriving it from the same input
+class _SharedEntry:
+    def __init__(self):
+        self.artifact = None
+        self.error = None
+        self.buildTime = 0
+        self.refCount = 0
+        self.ready = threading.Event()
+        
+        
+class ArtifactStore:
+    def __init__(self, directory = None, memoryLimit = DEFAULT_MEMORY_LIMIT):
+        self.directory = directory
+        self.memoryLimit = memoryLimit
+        self.memoryUsed = 0
+        self.lock = threading.Lock()
+        self.sharedEntries = {}
+        
+    def create(self, suffix = ""):
+        return Artifact(self, suffix)
+    
+    def fromBytes(self, data, suffix = ""):
+        artifact = self.create(suffix)
+        artifact.write(data)
+        return artifact
+    
+    def fromFile(self, fileName, suffix = ""):
+        artifact = self.create(suffix)
+        with open(fileName, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                artifact.write(block)
+        return artifact
+    
+    #an existing file used in place, it is not removed when the artifact is closed
+    def wrapFile(self, fileName):
+        artifact = Artifact(self, fileObject = open(fileName, "rb"))
+        artifact.fileObject.seek(0, 2)
+        artifact.size = artifact.fileObject.tell()
+        return artifact
+        
+    #returns the artifact for key and the build time saved, build is only
+    #called if no other request holds the artifact, all others wait for it
+    #and share it, releaseShared closes it once the last one is done
+    def acquireShared(self, key, build):
+        with self.lock:
+            entry = self.sharedEntries.get(key)
+            isBuilder = entry == None
+            if isBuilder:
+                entry = _SharedEntry()
+                self.sharedEntries[key] = entry
+            entry.refCount += 1
+        
+        if isBuilder:
+            startTime = time.time()
+            try:
+                entry.artifact = build()
+            except Exception as E:
+                entry.error = E
+                with self.lock:
+                    del self.sharedEntries[key]
+                raise
+            finally:
+                entry.buildTime = time.time() - startTime
+                entry.ready.set()
+            return (entry.artifact, None)
+        
+        entry.ready.wait()
+        if entry.error != None:
+            raise entry.error
+        return (entry.artifact, entry.buildTime)
+    
+    def releaseShared(self, key):
+        with self.lock:
+            entry = self.sharedEntries[key]
+            entry.refCount -= 1
+            if entry.refCount > 0:
+                return
+            del self.sharedEntries[key]
+        entry.artifact.close()
+        
+    def _reserve(self, numBytes):
+        with self.lock:
+            if self.memoryUsed + numBytes > self.memoryLimit:
+                return False
+            self.memoryUsed += numBytes
+            return True
+        
+    def _release(self, numBytes):
+        with self.lock:
+            self.memoryUsed -= numBytes
@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import collections
+import threading
+import time
+
+class ResultCache:
+    def __init__(self, maxSize, timeToLive):
+        self.maxSize = maxSize
+        self.timeToLive = timeToLive
+        self.lock = threading.Lock()
+        #key -> (output, storeTime), least recently used first
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        
+    def get(self, key):
+        with self.lock:
+            try:
+                output, storeTime = self.entries[key]
+            except KeyError:
+                return None
+            if storeTime + self.timeToLive < time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return (output, storeTime)
+        
+    def put(self, key, output):
+        if len(output) > self.maxSize:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (output, time.time())
+            self.size += len(output)
+            while self.size > self.maxSize:
+                self._remove(next(iter(self.entries)))
+                
+    def _remove(self, key):
+        output, storeTime = self.entries.pop(key)
+        self.size -= len(output)
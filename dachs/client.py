@@ -0,0 +1,285 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import asyncio
+import base64
+import collections
+import json
+import xml.sax.saxutils
+import zlib
+
+import websockets
+
+DEFAULT_PORT = 4443
+SERVER_TIMEOUT = 100
+CACHE_MARKER = "[dachs] served from cache"
+
+#output is None if the output was handed to an onOutput callback instead
+Result = collections.namedtuple("Result", ["output", "fromCache"])
+
+
+class DachsClientException(Exception):
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+        
+        
+#estimatedWait is in seconds, None if the server cannot estimate it
+class RequestRejectedException(DachsClientException):
+    def __init__(self, reason, estimatedWait):
+        DachsClientException.__init__(self, reason)
+        self.estimatedWait = estimatedWait
+        
+
+def _isTrue(value):
+    return str(value).strip().lower() in ("1", "yes", "true", "on")
+
+#targets is a list of (architecture, board), config holds the keys of the
+#[Config] section of a client configuration file, e.g. a configparser section
+def buildRequest(executable, targets, config, bypassCache = False):
+    xmlString = '<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>\n'
+    xmlString += "<ExecutionRequest>\n"
+    xmlString += '  <Executable encoding="Base64">'
+    xmlString += base64.b64encode(executable).decode()
+    xmlString += "  </Executable>\n"
+    
+    for architecture, board in targets:
+        xmlString += "  <Target>\n"
+        xmlString += "    <Architecture>" + architecture + "</Architecture>\n"
+        xmlString += "    <Board>" + board + "</Board>\n"
+        xmlString += "  </Target>\n"
+    
+    xmlString += "  <RetryMaximum>" + str(config["retryMaximum"]) + "</RetryMaximum>\n"
+    xmlString += "  <Timeout>" + str(config["timeout"]) + "</Timeout>\n"
+    xmlString += "  <EndString>" + str(config["endString"]) + "</EndString>\n"
+    xmlString += "  <SerialTimeout>" + str(config["serialTimeout"]) + "</SerialTimeout>\n"
+    
+    if _isTrue(config.get("cacheable", "no")):
+        xmlString += "  <Cacheable>yes</Cacheable>\n"
+    
+    if bypassCache:
+        xmlString += "  <BypassCache>yes</BypassCache>\n"
+    
+    #optional patterns, one per line, that end the test early with a verdict
+    for key, element in (("passPatterns", "PassPattern"), ("failPatterns", "FailPattern"), ("hangPatterns", "HangPattern")):
+        for pattern in str(config.get(key, "")).splitlines():
+            if pattern.strip():
+                xmlString += "  <" + element + ">" + xml.sax.saxutils.escape(pattern.strip()) + "</" + element + ">\n"
+    
+    if "silenceTimeout" in config:
+        xmlString += "  <SilenceTimeout>" + str(config["silenceTimeout"]) + "</SilenceTimeout>\n"
+    
+    #the server answers with a JSON summary of the tests instead of the output
+    if "resultFormat" in config:
+        xmlString += "  <ResultFormat>" + xml.sax.saxutils.escape(str(config["resultFormat"])) + "</ResultFormat>\n"
+        if _isTrue(config.get("fullLog", "no")):
+            xmlString += "  <FullLog>yes</FullLog>\n"
+    
+    xmlString += "  <Compression>zlib</Compression>\n"
+    xmlString += "</ExecutionRequest>"
+    return xmlString.encode()
+
+
+#splits the output of a request with resultFormat = json into the summary and
+#the output of the board, which is empty unless fullLog was requested
+def parseStructuredResult(output):
+    if isinstance(output, str):
+        output = output.encode()
+    if output.startswith(CACHE_MARKER.encode()):
+        output = output.split(b"\n", 1)[1]
+    summary, log = (output.split(b"\n", 1) + [b""])[:2]
+    try:
+        return (json.loads(summary.decode()), log)
+    except ValueError:
+        raise DachsClientException("The output is no structured result: " + summary[:200].decode(errors = "replace"))
+
+
+class _Submission:
+    def __init__(self, request, onOutput):
+        self.request = request
+        self.onOutput = onOutput
+        self.future = asyncio.Future()
+        self.chunks = []
+        self.fromCache = None
+        #the number of the request on its connection, None until it is sent
+        self.sequence = None
+        
+    def feed(self, data):
+        if not data:
+            return
+        if self.fromCache == None:
+            self.fromCache = data.startswith(CACHE_MARKER.encode())
+        if self.onOutput:
+            self.onOutput(data)
+        else:
+            self.chunks.append(data)
+            
+    def finish(self):
+        if not self.future.done():
+            output = None if self.onOutput else b"".join(self.chunks)
+            self.future.set_result(Result(output, bool(self.fromCache)))
+            
+    def fail(self, exception):
+        if not self.future.done():
+            self.future.set_exception(exception)
+        
+        
+#one websocket connection, the server answers the requests sent over it in
+#order, so the responses are matched to the submissions in flight by position
+class _Connection:
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.nextSequence = 0
+        self.inFlight = collections.deque()
+        self.sendLock = asyncio.Lock()
+        self.closed = False
+        self.reader = asyncio.ensure_future(self._read())
+        
+    @asyncio.coroutine
+    def send(self, submission):
+        with (yield from self.sendLock):
+            self._number(submission)
+            self.inFlight.append(submission)
+            yield from self.websocket.send(submission.request)
+            
+    #asks the server to admit the request before the executable is uploaded,
+    #nothing else is sent over the connection in between
+    @asyncio.coroutine
+    def sendAdmitted(self, submission, targets):
+        with (yield from self.sendLock):
+            admission = _Submission(("admit " + ", ".join(targets)), None)
+            self.inFlight.append(admission)
+            yield from self.websocket.send(admission.request)
+            reply = (yield from admission.future).output.decode()
+            if reply != "admitted":
+                fields = reply.split(" ", 2)
+                estimatedWait = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else None
+                raise RequestRejectedException(fields[2] if len(fields) > 2 else reply, estimatedWait)
+            self._number(submission)
+            self.inFlight.append(submission)
+            yield from self.websocket.send(submission.request)
+            
+    #the server numbers the requests of a connection in the order they
+    #arrive, admit messages do not count
+    def _number(self, submission):
+        submission.sequence = self.nextSequence
+        self.nextSequence += 1
+            
+    #the cancel names the request, so the server neither cancels another
+    #request of the pipeline nor one whose output is already on its way
+    def cancel(self, submission):
+        if submission.sequence != None and submission in self.inFlight and not self.closed:
+            asyncio.ensure_future(self.websocket.send("cancel " + str(submission.sequence)))
+            
+    @asyncio.coroutine
+    def _read(self):
+        try:
+            while True:
+                frame = yield from self.websocket.recv()
+                if not self.inFlight:
+                    continue
+                submission = self.inFlight[0]
+                if isinstance(frame, str):
+                    #servers without compression send the output as one text frame
+                    submission.feed(frame.encode())
+                else:
+                    decompressor = zlib.decompressobj()
+                    while frame:
+                        submission.feed(decompressor.decompress(frame))
+                        frame = yield from self.websocket.recv()
+                    submission.feed(decompressor.flush())
+                self.inFlight.popleft()
+                submission.finish()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            while self.inFlight:
+                self.inFlight.popleft().fail(DachsClientException("Connection to the server closed"))
+                
+    @asyncio.coroutine
+    def close(self):
+        yield from self.websocket.close()
+        yield from self.reader
+        
+        
+#submits execution requests to one server over a pool of up to numConnections
+#connections, each one carrying up to pipelineDepth requests at a time
+class DachsClient:
+    def __init__(self, host = "localhost", port = DEFAULT_PORT, sslContext = None, numConnections = 1, pipelineDepth = 4, timeout = SERVER_TIMEOUT):
+        self.uri = "wss://" + host + ":" + str(port)
+        self.sslContext = sslContext
+        self.numConnections = numConnections
+        self.pipelineDepth = pipelineDepth
+        self.timeout = timeout
+        self.connections = []
+        self.slots = asyncio.Semaphore(numConnections * pipelineDepth)
+        self.connectLock = asyncio.Lock()
+        
+    #executable is the content of the executable, target "architecture/board"
+    #or a list of them for a matrix request, config the [Config] keys of a
+    #client configuration, onOutput is called with each piece of the output
+    #as it arrives, returns a Result, with checkAdmission the executable is
+    #only uploaded once the server admitted the request, otherwise a
+    #RequestRejectedException is raised
+    @asyncio.coroutine
+    def submit(self, executable, target, config, onOutput = None, bypassCache = False, checkAdmission = False):
+        targets = [target] if isinstance(target, str) else list(target)
+        request = buildRequest(executable, [t.strip().split("/") for t in targets], config, bypassCache)
+        submission = _Submission(request, onOutput)
+        
+        yield from self.slots.acquire()
+        try:
+            connection = yield from self._connection()
+            if checkAdmission:
+                yield from connection.sendAdmitted(submission, targets)
+            else:
+                yield from connection.send(submission)
+            try:
+                return (yield from submission.future)
+            except asyncio.CancelledError:
+                connection.cancel(submission)
+                raise
+        finally:
+            self.slots.release()
+            
+    @asyncio.coroutine
+    def close(self):
+        for connection in self.connections:
+            yield from connection.close()
+        self.connections = []
+            
+    #the least busy connection, a new one is opened while the pool is not
+    #full and every connection has requests in flight
+    @asyncio.coroutine
+    def _connection(self):
+        with (yield from self.connectLock):
+            self.connections = [c for c in self.connections if not c.closed]
+            idle = [c for c in self.connections if not c.inFlight]
+            if not idle and len(self.connections) < self.numConnections:
+                websocket = yield from websockets.connect(self.uri, ssl = self.sslContext, timeout = self.timeout, max_size = None)
+                self.connections.append(_Connection(websocket))
+                return self.connections[-1]
+            return min(self.connections, key = lambda c: len(c.inFlight))
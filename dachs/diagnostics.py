@@ -0,0 +1,196 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+DEFAULT_SAMPLING_INTERVAL = 0.005
+#shorter intervals would keep the sampling thread busy holding the GIL
+MIN_SAMPLING_INTERVAL = 0.001
+
+#what a thread is working on, e.g. request and target, by thread ident
+_CONTEXTS = {}
+_CONTEXTS_LOCK = threading.Lock()
+
+def setContext(**context):
+    with _CONTEXTS_LOCK:
+        _CONTEXTS[threading.get_ident()] = context
+        
+def updateContext(**context):
+    with _CONTEXTS_LOCK:
+        _CONTEXTS.setdefault(threading.get_ident(), {}).update(context)
+        
+def clearContext():
+    with _CONTEXTS_LOCK:
+        _CONTEXTS.pop(threading.get_ident(), None)
+        
+#for executor threads, which run one request after another
+def runWithContext(context, function, *args):
+    setContext(**context)
+    try:
+        return function(*args)
+    finally:
+        clearContext()
+        
+def _describeThread(ident, names):
+    with _CONTEXTS_LOCK:
+        context = dict(_CONTEXTS.get(ident, {}))
+    description = names.get(ident, "unknown") + " (" + str(ident) + ")"
+    if context:
+        description += " " + " ".join(k + "=" + str(v) for k, v in sorted(context.items()))
+    return description
+        
+def dumpThreads():
+    names = dict((t.ident, t.name) for t in threading.enumerate())
+    lines = []
+    for ident, frame in sorted(sys._current_frames().items()):
+        lines.append("Thread " + _describeThread(ident, names))
+        lines.extend(l.rstrip("\n") for l in traceback.format_stack(frame))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+#samples the stacks of all threads and counts them in the collapsed format
+#of flamegraph.pl, one line "thread;outer;...;inner count" per stack
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = collections.Counter()
+        self.thread = None
+        self.stopRequested = threading.Event()
+        self.startTime = None
+        self.numSamples = 0
+        
+    def isRunning(self):
+        return self.thread != None
+        
+    def start(self, interval = DEFAULT_SAMPLING_INTERVAL):
+        interval = max(interval, MIN_SAMPLING_INTERVAL)
+        with self.lock:
+            if self.thread != None:
+                return False
+            self.samples = collections.Counter()
+            self.numSamples = 0
+            self.startTime = time.time()
+            self.stopRequested.clear()
+            self.thread = threading.Thread(target = self._sample, args = (interval,), name = "samplingProfiler")
+            self.thread.daemon = True
+            self.thread.start()
+            return True
+        
+    #returns the collapsed stacks sampled since start
+    def stop(self):
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread == None:
+            return ""
+        self.stopRequested.set()
+        thread.join()
+        return self.collapsed()
+    
+    def collapsed(self):
+        with self.lock:
+            samples = sorted(self.samples.items())
+        return "".join(stack + " " + str(count) + "\n" for stack, count in samples)
+    
+    def status(self):
+        if not self.isRunning():
+            return "profiler stopped"
+        return "profiler running for " + str(int(time.time() - self.startTime)) + " seconds, " + str(self.numSamples) + " samples"
+        
+    def _sample(self, interval):
+        ownIdent = threading.get_ident()
+        while not self.stopRequested.wait(interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == ownIdent:
+                    continue
+                functions = []
+                while frame != None:
+                    code = frame.f_code
+                    functions.append(code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(frame.f_lineno) + ")")
+                    frame = frame.f_back
+                functions.append(names.get(ident, "unknown"))
+                stacks.append(";".join(reversed(functions)).replace(" ", "_"))
+            with self.lock:
+                self.samples.update(stacks)
+                self.numSamples += 1
+                
+                
+PROFILER = SamplingProfiler()
+
+def _writeFile(directory, prefix, suffix, content):
+    fileName = os.path.join(directory, prefix + time.strftime("%Y%m%d-%H%M%S") + "-" + str(os.getpid()) + suffix)
+    with open(fileName, "w") as f:
+        f.write(content)
+    return fileName
+
+#SIGUSR1 writes a thread dump, SIGUSR2 starts the profiler or stops it and
+#writes the collapsed stacks, both into directory
+def installSignalHandlers(directory):
+    def dump(signum, frame):
+        print("thread dump written to " + _writeFile(directory, "dachs-threads-", ".txt", dumpThreads()))
+        
+    def toggleProfiler(signum, frame):
+        if PROFILER.isRunning():
+            #stopping joins the sampling thread, which must not happen inside the signal handler
+            threading.Thread(target = lambda: print("profile written to " + _writeFile(directory, "dachs-profile-", ".folded", PROFILER.stop()))).start()
+        else:
+            PROFILER.start()
+            print("profiler started")
+            
+    signal.signal(signal.SIGUSR1, dump)
+    signal.signal(signal.SIGUSR2, toggleProfiler)
+    
+#handles "threads", "profile start [interval]", "profile stop" and
+#"profile status", returns the reply
+def handleCommand(command):
+    words = command.split()
+    if words == ["threads"]:
+        return dumpThreads()
+    if len(words) >= 2 and words[0] == "profile":
+        if words[1] == "start":
+            interval = DEFAULT_SAMPLING_INTERVAL
+            if len(words) > 2:
+                try:
+                    interval = float(words[2])
+                except ValueError:
+                    return "invalid interval: " + words[2]
+                if not MIN_SAMPLING_INTERVAL <= interval < float("inf"):
+                    return "interval must be at least " + str(MIN_SAMPLING_INTERVAL) + " seconds"
+            return "profiler started" if PROFILER.start(interval) else "profiler already running"
+        if words[1] == "stop":
+            return PROFILER.stop()
+        if words[1] == "status":
+            return PROFILER.status()
+    return "unknown command: " + command
@@ -0,0 +1,79 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+#only the most recent runs are used for estimations, old runs might stem from
+#a different version of the target or the server
+NUM_RUNS_FOR_ESTIMATION = 10
+
+def hashBuffer(buffer):
+    return hashlib.sha256(buffer).hexdigest()
+
+
+class RunHistory:
+    def __init__(self, fileName):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(fileName, check_same_thread = False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs ("
+                                    "exeHash TEXT, architecture TEXT, board TEXT, target TEXT, "
+                                    "finished REAL, queueWait REAL, buildTime REAL, runTime REAL, "
+                                    "retries INTEGER, result TEXT)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS runsByExecutable ON runs (exeHash, architecture, board)")
+            
+    def record(self, exeHash, architecture, board, target, queueWait, buildTime, runTime, retries, result):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (exeHash, architecture, board, target, time.time(), queueWait, buildTime, runTime, retries, result))
+            
+    def _recentRunTimes(self, exeHash, architecture, board):
+        with self.lock:
+            rows = self.connection.execute("SELECT runTime FROM runs WHERE exeHash = ? AND architecture = ? AND board = ? "
+                                           "AND result = 'success' ORDER BY finished DESC LIMIT ?",
+                                           (exeHash, architecture, board, NUM_RUNS_FOR_ESTIMATION)).fetchall()
+        return [r[0] for r in rows]
+    
+    def expectedRunTime(self, exeHash, architecture, board):
+        runTimes = self._recentRunTimes(exeHash, architecture, board)
+        if not runTimes:
+            return None
+        return sum(runTimes) / len(runTimes)
+    
+    def maximumRunTime(self, exeHash, architecture, board, minimumNumRuns):
+        runTimes = self._recentRunTimes(exeHash, architecture, board)
+        if len(runTimes) < minimumNumRuns:
+            return None
+        return max(runTimes)
+    
+    def averageRunTime(self, architecture, board):
+        with self.lock:
+            row = self.connection.execute("SELECT AVG(runTime) FROM runs WHERE architecture = ? AND board = ? AND result = 'success'",
+                                          (architecture, board)).fetchone()
+        return row[0]
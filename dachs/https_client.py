@@ -25,116 +25,130 @@
 # OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
 # SUCH DAMAGE.
 
+import argparse
 import asyncio
-import websockets
+import configparser
+import signal
 import ssl
-import argparse
 import subprocess
+import sys
 import tempfile
-import base64
-import configparser
 
-SERVER_TIMEOUT = 100
+import client
 
-def getXML(exeFileName, infoFileName):
+#directory is where the stripped copy is stored, default is the system's temp directory
+def readExecutable(exeFileName, strip = False, directory = None):
+    if not strip:
+        with open(exeFileName, "r+b") as exeFile:
+            return exeFile.read()
+    
+    if(directory):
+        strippedFile = tempfile.NamedTemporaryFile(suffix = ".exe", delete = True, dir = directory)
+    else:
+        strippedFile = tempfile.NamedTemporaryFile(suffix = ".exe", delete = True)
+    with open(exeFileName, "r+b") as inFile:
+        exeFileContent = inFile.read()
+        lengthBeforeStripping = len(exeFileContent)
+    with open(strippedFile.name, "w+b") as stripFile:
+        stripFile.write(exeFileContent)
+    subprocess.call("strip " + strippedFile.name + " -g -S", shell = True)
+    with open(strippedFile.name, "r+b") as stripFile:
+        fileBinary = stripFile.read()
+        lengthAfterStripping = len(fileBinary)
+        print("Before stripping: " + str(lengthBeforeStripping) + "\nAfter stripping: " + str(lengthAfterStripping) + "\n\n")
+    strippedFile.close()
+    return fileBinary
+
+#returns the targets as architecture/board and the [Config] section
+def readInfo(infoFileName):
     config = configparser.ConfigParser()
     config.read(infoFileName)
-    
-    global xmlFile
-    
-    xmlString = '<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>\n'
-    xmlString += "<ExecutionRequest>\n"
-    xmlString += '  <Executable encoding="Base64">'
-     
-    with open(exeFileName,"r+b") as byteFile:
-        encodedInformation = base64.b64encode(byteFile.read())
-        print(len(encodedInformation))
-        
-    with open(xmlFile.name, "w") as xmlF:
-        xmlF.write(xmlString)
+    #a matrix request lists several targets as architecture/board
+    if "targets" in config["Target"]:
+        targets = [t.strip() for t in config["Target"]["targets"].split(",")]
+    else:
+        targets = [config["Target"]["architecture"] + "/" + config["Target"]["board"]]
+    return (targets, config["Config"])
+
+#writes the output of one request as it arrives
+class OutputWriter:
+    def __init__(self, outFile):
+        self.outFile = outFile
+        self.outputFile = None
         
-    with open(xmlFile.name, "a+b") as xmlF:
-        xmlF.write(encodedInformation)
+    def __call__(self, data):
+        if self.outputFile == None:
+            if data.startswith(client.CACHE_MARKER.encode()):
+                print(data.split(b"\n", 1)[0].decode(errors = "ignore"))
+                sys.stdout.flush()
+            if self.outFile == "STDOUT":
+                self.outputFile = sys.stdout.buffer
+            else:
+                self.outputFile = open(self.outFile, "wb")
+        self.outputFile.write(data)
         
-    xmlString = ""
-    xmlString += "  </Executable>\n"
-    xmlString += "  <Target>\n"
-    xmlString += "    <Architecture>"
-    xmlString += config["Target"]["architecture"]
-    xmlString += "</Architecture>\n"
-
-    xmlString += "    <Board>"
-    xmlString += config["Target"]["board"]
-    xmlString += "</Board>\n"
-    xmlString += "  </Target>\n"
+    def close(self):
+        if self.outputFile is sys.stdout.buffer:
+            self.outputFile.flush()
+        elif self.outputFile != None:
+            self.outputFile.close()
 
-    xmlString += "  <RetryMaximum>"
-    xmlString += config["Config"]["retryMaximum"]
-    xmlString += "</RetryMaximum>\n"
-
-    xmlString += "  <Timeout>"
-    xmlString += config["Config"]["timeout"]
-    xmlString += "</Timeout>\n"
-    
-    xmlString += "  <EndString>"
-    xmlString += config["Config"]["endString"]
-    xmlString += "</EndString>\n"
-    
-    xmlString += "  <SerialTimeout>"
-    xmlString += config["Config"]["serialTimeout"]
-    xmlString += "</SerialTimeout>\n"
-    xmlString += "</ExecutionRequest>"
-
-    with open(xmlFile.name, "a") as xmlF:
-        xmlF.write(xmlString)
-    
-    return xmlF
+@asyncio.coroutine
+def runJob(dachsClient, jobSlots, job, strip, directory, bypassCache, checkAdmission):
+    exeFileName, infoFileName, outFile = job
+    #only as many executables are read as can be sent
+    with (yield from jobSlots):
+        targets, config = readInfo(infoFileName)
+        writer = OutputWriter(outFile)
+        try:
+            yield from dachsClient.submit(readExecutable(exeFileName, strip, directory), targets, config, writer, bypassCache, checkAdmission)
+        except client.RequestRejectedException as RRE:
+            waitText = str(RRE.estimatedWait) + " seconds" if RRE.estimatedWait != None else "unknown"
+            print("request for " + exeFileName + " rejected, " + str(RRE) + ", estimated wait " + waitText)
+            return
+        finally:
+            writer.close()
+    print("received file")
 
+#all jobs share the connection of dachsClient, up to pipelineDepth requests
+#are sent before their outputs arrive and run concurrently, the server
+#answers them in order,
+#dachsClient is closed afterwards
 @asyncio.coroutine
-def on_connect():
-    websocket = yield from websockets.connect(
-        "wss://" + host + ":" + port, ssl = ssl_context, timeout = SERVER_TIMEOUT)
+def runJobs(dachsClient, jobs, pipelineDepth, strip = False, directory = None, bypassCache = False, checkAdmission = False):
+    jobSlots = asyncio.Semaphore(pipelineDepth)
+    tasks = [asyncio.ensure_future(runJob(dachsClient, jobSlots, job, strip, directory, bypassCache, checkAdmission)) for job in jobs]
+    
+    #Ctrl-C asks the server to cancel the outstanding requests and release the boards
+    def cancel():
+        for task in tasks:
+            task.cancel()
+    asyncio.get_event_loop().add_signal_handler(signal.SIGINT, cancel)
 
     try:
-        if(args.strip):
-            if(args.directory):
-                strippedFile = tempfile.NamedTemporaryFile(suffix = ".exe", delete = True, dir = args.directory)
-            else:
-                strippedFile = tempfile.NamedTemporaryFile(suffix = ".exe", delete = True)
-            with open(args.inputExe, "r+b") as inFile:
-                exeFileContent = inFile.read()
-                lengthBeforeStripping = len(exeFileContent)
-            with open(strippedFile.name, "w+b") as stripFile:
-                stripFile.write(exeFileContent)
-            subprocess.call("strip " + strippedFile.name + " -g -S", shell = True)
-            xFile = getXML(strippedFile.name, args.inputInfo)
-            with open(strippedFile.name, "r+b") as stripFile:
-                fileBinary = stripFile.read()
-                lengthAfterStripping = len(fileBinary)
-                print("Before stripping: " + str(lengthBeforeStripping) + "\nAfter stripping: " + str(lengthAfterStripping) + "\n\n")
-        else:
-            xFile = getXML(args.inputExe, args.inputInfo)
-        
-        with open(xFile.name, "r+b") as fileToServer:
-            fileBinary = fileToServer.read()
-            yield from websocket.send(fileBinary)
-        
-        xFile.close()
-        
-        output = yield from websocket.recv()
-        
-        if outFile == "STDOUT":
-            print(output)
-        else:
-            with open(outFile,"w") as outputFile:
-                outputFile.write(output)
-            
-        print("received file")
-        
+        yield from asyncio.wait(tasks)
+        for task in tasks:
+            if not task.cancelled() and task.exception():
+                print(task.exception())
     finally:
-        yield from websocket.close()
+        asyncio.get_event_loop().remove_signal_handler(signal.SIGINT)
+        yield from dachsClient.close()
         print("connection closed")
 
+def readBatchFile(batchFileName):
+    jobs = []
+    with open(batchFileName) as batchFile:
+        for line in batchFile:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) == 2:
+                fields.append("STDOUT")
+            if len(fields) != 3:
+                raise ValueError("Batch file lines need the form: inputExe inputInfo [output]")
+            jobs.append(tuple(fields))
+    return jobs
+
 if __name__ == "__main__":
     #command line params
     parser = argparse.ArgumentParser()
@@ -146,6 +160,10 @@ if __name__ == "__main__":
     parser.add_argument("--host", help = "Hostname, default is localhost")
     parser.add_argument("--port", "-p", help = "Portnumber, default is 4443", type = int)
     parser.add_argument("--directory", "-d", help = "Directory the tempfile is stored in, default is ./")
+    parser.add_argument("--no-cache", help = "Run on the hardware even if the server has a cached result", action="store_true")
+    parser.add_argument("--batch", "-b", help = "File with further requests, one 'inputExe inputInfo [output]' per line, sent over the same connection")
+    parser.add_argument("--pipeline", help = "Number of requests sent before their output arrives, they run concurrently, default is 1", type = int, default = 1)
+    parser.add_argument("--admission-check", help = "Ask the server to admit a request before uploading the executable", action="store_true")
     args = parser.parse_args()
     
     
@@ -165,13 +183,14 @@ if __name__ == "__main__":
     if args.cert:
         cert = str(args.cert)
         
-        
-    if(args.directory):
-        xmlFile = tempfile.NamedTemporaryFile(suffix = ".xml", delete = True, dir = args.directory)
-    else:
-        xmlFile = tempfile.NamedTemporaryFile(suffix = ".xml", delete = True)
     
     ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
     ssl_context.load_cert_chain(cert)
     ssl_context.verify_mode = ssl.CERT_NONE
-    asyncio.get_event_loop().run_until_complete(on_connect())
+    
+    jobs = [(args.inputExe, args.inputInfo, outFile)]
+    if args.batch:
+        jobs += readBatchFile(args.batch)
+    pipelineDepth = max(args.pipeline, 1)
+    dachsClient = client.DachsClient(host, port, ssl_context, 1, pipelineDepth)
+    asyncio.get_event_loop().run_until_complete(runJobs(dachsClient, jobs, pipelineDepth, args.strip, args.directory, args.no_cache, args.admission_check))
@@ -29,19 +29,82 @@ import abc
 import argparse
 import asyncio
 import base64
+import collections
 import concurrent.futures
 import configparser
+import fnmatch
 import functools
+import hmac
+import heapq
 import importlib
+import io
+import itertools
 import libxml2
+import math
 import ssl
 import sys
-import tempfile
 import threading
+import time
 import websockets
 
+#targets, switches and workers import https_server, they have to get this
+#module instead of a second copy, otherwise their FatalExceptions are not
+#the ones caught here
+if __name__ == "__main__":
+    sys.modules["https_server"] = sys.modules["__main__"]
+
+import admission
+import artifacts
+import cache
+import diagnostics
+import history as historyModule
+import metrics
+import patterns
+import results
+import spool
+import workers
+
 CLIENT_HANDLER = None
+ADMISSION = None
+#shared by all requests, sized to the number of requests admitted at a time
+EXECUTOR = None
+#numbers the requests for the thread dumps
+REQUEST_IDS = itertools.count(1)
 
+#shared between the websocket that may cancel a request and the threads
+#working on it, callbacks are called once the request is cancelled
+class CancelToken:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.callbacks = []
+        
+    def addCallback(self, callback):
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return
+        callback()
+        
+    def removeCallback(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+        
+    def cancel(self):
+        with self.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks = list(self.callbacks)
+            self.callbacks = []
+        for callback in callbacks:
+            callback()
+            
+    def isCancelled(self):
+        return self.cancelled
+    
+    
 class StateMachine:
     IDLE = 0
     RECEIVED_FILE = 1
@@ -53,8 +116,10 @@ class StateMachine:
     FINISHED = 7
     RECONFIGURE_DEVICE = 8
     ERROR_STATE = 9
+    STATE_NAMES = ["IDLE", "RECEIVED_FILE", "DEVICE_SELECTED", "FILE_PROCESSED", "TEST_RUNNING", "OUTPUT_RECEIVED",
+                   "DEVICE_NOT_RESPONDING", "FINISHED", "RECONFIGURE_DEVICE", "ERROR_STATE"]
     
-    def __init__(self, targetConfig, deviceHandler, maxNumTimeouts, switch, powerPort):
+    def __init__(self, targetConfig, deviceHandler, maxNumTimeouts, switch, powerPort, labels = None, cancelToken = None):
         self.state = self.DEVICE_SELECTED
         self.inEndState = False
         self.numTimeouts = 0 
@@ -63,16 +128,48 @@ class StateMachine:
         self.powerPort = powerPort
         self.deviceHandler = deviceHandler
         self.maxNumTimeouts = maxNumTimeouts
+        #labels identify the board in the metrics, e.g. architecture, board and target
+        self.labels = labels if labels else {}
+        self.transitions = []
+        self.stateDurations = {}
+        self.lastRunTime = None
+        self.cancelToken = cancelToken if cancelToken else CancelToken()
+        self.cancelled = False
+        self.verdict = None
         
     def run(self):
-        while not self.inEndState:
-            self._handleState()
+        self.cancelToken.addCallback(self.deviceHandler.cancel)
+        try:
+            self._run()
+        finally:
+            self.cancelToken.removeCallback(self.deviceHandler.cancel)
+            #a state that raised, e.g. a switch failing to restart the board,
+            #skipped FINISHED, the handler still has to release what it holds
+            if not self.inEndState:
+                self.inEndState = True
+                try:
+                    self.deviceHandler.doExit()
+                except Exception as E:
+                    print(type(E))
+                    print(E)
             
         if self.wasSuccessfull:
             return self.output
         else:
             return None
         
+    def _run(self):
+        while not self.inEndState:
+            state = self.state
+            startTime = time.time()
+            self.transitions.append((state, startTime))
+            try:
+                self._handleState()
+            finally:
+                duration = time.time() - startTime
+                self.stateDurations[state] = self.stateDurations.get(state, 0) + duration
+                metrics.METRICS.observe("dachs_state_seconds", duration, state = self.STATE_NAMES[state], **self.labels)
+        
     def _handleState(self):
         if self.state == self.IDLE:
             raise StateMachineException("Error, handleState(IDLE)")
@@ -96,11 +193,21 @@ class StateMachine:
             raise StateMachineException("Error, unknown state")
         
     def _processFile(self):
+        startTime = time.time()
         self.deviceHandler.processFile()
+        metrics.METRICS.observe("dachs_image_build_seconds", time.time() - startTime, **self.labels)
         self.state = self.FILE_PROCESSED
         
     def _transmitToDevice(self):
+        if self.cancelToken.isCancelled():
+            self.cancelled = True
+            self.wasSuccessfull = False
+            self.state = self.FINISHED
+            return
+        startTime = time.time()
         self.output = self.deviceHandler.run()
+        self.lastRunTime = time.time() - startTime
+        self.verdict = self.deviceHandler.verdict
         #run responds None in case the device timed out more times than allowed
         if self.output:
             self.state = self.OUTPUT_RECEIVED
@@ -112,20 +219,34 @@ class StateMachine:
         self.state = self.FINISHED
         
     def _reconfigureDevice(self):
+        if self.cancelToken.isCancelled():
+            #the test might still be running, switching off releases the board
+            #right away without using up the restarts of the switch, the next
+            #request switches it on again
+            self.cancelled = True
+            self.wasSuccessfull = False
+            self.state = self.FINISHED
+            self.deviceHandler.handleTimeout()
+            self.switch.switchOff(self.powerPort)
+            return
+        
         self.numTimeouts += 1
         if self.numTimeouts > self.maxNumTimeouts:
             self.wasSuccessfull = False
             self.state = self.FINISHED
             self.deviceHandler.handleTimeout()
             self.switch.restart(self.powerPort)
+            metrics.METRICS.increment("dachs_restarts_total", **self.labels)
         else:
             self.switch.restart(self.powerPort)
+            metrics.METRICS.increment("dachs_restarts_total", **self.labels)
+            metrics.METRICS.increment("dachs_retries_total", **self.labels)
             self.deviceHandler.handleTimeout()
             self.state = self.FILE_PROCESSED
         
     def _doOnExit(self):
-        self.deviceHandler.doExit()
         self.inEndState = True
+        self.deviceHandler.doExit()
         #if handleState is invoked another time, error is raised
         self.state = self.ERROR_STATE
         
@@ -140,10 +261,28 @@ class FatalException(Exception):
     def __init__(self, *args, **kwargs):
         Exception.__init__(self, *args, **kwargs)
         
+        
+class RequestCancelledException(Exception):
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
+        
+        
+class RequestRejectedException(Exception):
+    def __init__(self, reason, estimatedWait):
+        Exception.__init__(self, reason)
+        self.estimatedWait = estimatedWait
+        
 
 class TargetHandler(abc.ABC):
+    #True if the target can run an image again that it already has loaded,
+    #boards holding the requested image are preferred then
+    IMAGE_REUSE = False
+    #(verdict, pattern) of the last run, set by targets that detect verdicts,
+    #a failed test returns its output and is not retried
+    verdict = None
+    
     @abc.abstractmethod
-    def __init__(self, testFile, clientConfigFileName, index, targetConfig, sectionName):
+    def __init__(self, testFile, clientConfig, index, targetConfig, sectionName):
         pass
     
     @abc.abstractmethod
@@ -162,6 +301,17 @@ class TargetHandler(abc.ABC):
     def handleTimeout(self):
         pass
     
+    #called from another thread when the request is cancelled, run() is
+    #supposed to return None as soon as possible afterwards
+    def cancel(self):
+        pass
+    
+    #called for a quarantined board after it was power cycled, True puts the
+    #board back into service
+    @classmethod
+    def probe(cls, targetConfig, sectionName):
+        return True
+    
 class Switch(abc.ABC):
     @abc.abstractmethod
     def __init__(self, sectionName):
@@ -191,73 +341,377 @@ class Switch(abc.ABC):
     def configure(self, cfgFile):
         pass
     
+    #True or False if the switch knows whether the socket is powered, None otherwise
+    def isPowered(self, doseID):
+        return None
+    
+    
+class BoardState:
+    def __init__(self, sectionName):
+        self.sectionName = sectionName
+        self.busy = False
+        self.lastImage = None
+        self.lastTimeout = None
+        self.consecutiveTimeouts = 0
+        self.quarantined = False
+        self.quarantineReason = None
+        self.quarantinedSince = None
+        
+    def hadRecentTimeout(self, penaltyTime):
+        return self.lastTimeout != None and self.lastTimeout + penaltyTime > time.time()
+    
+    def healthReport(self):
+        return {"healthy": not self.quarantined, "reason": self.quarantineReason,
+                "quarantinedSince": self.quarantinedSince, "consecutiveTimeouts": self.consecutiveTimeouts}
+    
     
 class TargetHandlerGroup():
+    FIFO = "fifo"
+    LONGEST_FIRST = "longestFirst"
+    SHORTEST_FIRST = "shortestFirst"
+    
+    DEFAULT_TIMEOUT_PENALTY_TIME = 600
+    DEFAULT_QUARANTINE_TIMEOUTS = 3
+    DEFAULT_PROBE_INTERVAL = 300
+    
     def __init__(self, targetConfig, handlerClassName):
         self.sectionNames = []
-        self.lockList = []
+        self.boardStates = []
         self.handlerClassName = handlerClassName
         self.targetConfig = targetConfig
-        self.sema = None
+        #waiting requests, ordered by (priority, arrival)
+        self.waiting = []
+        self.arrivalCounter = itertools.count()
+        self.condition = threading.Condition()
         
     def addTargetHandler(self, sectionName):
-        self.lockList.append(threading.Lock())
+        self.boardStates.append(BoardState(sectionName))
         self.sectionNames.append(sectionName)
+        self._reportHealth(len(self.boardStates) - 1)
         
-    def handle(self, fileInput, clientConfigFile):
-        if self.sema == None:
-            self.sema = threading.BoundedSemaphore(len(self.lockList))
+    def _priority(self, expectedRunTime):
+        policy = self.targetConfig.getSchedulingPolicy()
+        if policy == self.FIFO or expectedRunTime == None:
+            return 0
+        elif policy == self.LONGEST_FIRST:
+            return -expectedRunTime
+        elif policy == self.SHORTEST_FIRST:
+            return expectedRunTime
+        else:
+            raise FatalException("Unknown scheduling policy: " + str(policy))
         
-        print("now: acquire")
-        self.sema.acquire()
+    def _freeBoards(self):
+        return [i for i in range(len(self.boardStates)) if not self.boardStates[i].busy and not self.boardStates[i].quarantined]
+    
+    def _hasHealthyBoard(self):
+        return any(not state.quarantined for state in self.boardStates)
+    
+    #prefer boards without recent timeouts, then powered boards, then boards
+    #that already hold the image
+    def _boardRank(self, boardID, image, penaltyTime):
+        state = self.boardStates[boardID]
+        switch = self.targetConfig.getSwitch(self.targetConfig.getValue(state.sectionName, "switch"))
+        powerPort = int(self.targetConfig.getValue(state.sectionName, "powerport"))
+        hasImage = self.handlerClassName.IMAGE_REUSE and image != None and state.lastImage == image
+        return (state.hadRecentTimeout(penaltyTime), switch.isPowered(powerPort) != True, not hasImage, boardID)
+    
+    def _wakeWaiting(self):
+        with self.condition:
+            self.condition.notify_all()
+    
+    def _acquireBoard(self, priority, image, cancelToken):
+        penaltyTime = self.DEFAULT_TIMEOUT_PENALTY_TIME
+        if self.targetConfig.hasValue("httpsServer", "timeoutPenaltyTime"):
+            penaltyTime = int(self.targetConfig.getValue("httpsServer", "timeoutPenaltyTime"))
+            
+        cancelToken.addCallback(self._wakeWaiting)
+        try:
+            with self.condition:
+                ticket = (priority, next(self.arrivalCounter))
+                heapq.heappush(self.waiting, ticket)
+                while (not cancelToken.isCancelled() and self._hasHealthyBoard()
+                       and (self.waiting[0] != ticket or not self._freeBoards())):
+                    self.condition.wait()
+                if cancelToken.isCancelled() or not self._hasHealthyBoard():
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self.condition.notify_all()
+                    if cancelToken.isCancelled():
+                        raise RequestCancelledException("Request cancelled while waiting for a board")
+                    raise FatalException("All boards of " + ", ".join(self.sectionNames) + " are quarantined")
+                heapq.heappop(self.waiting)
+                boardID = min(self._freeBoards(), key = lambda i: self._boardRank(i, image, penaltyTime))
+                self.boardStates[boardID].busy = True
+                #the next waiting request might find a free board as well
+                self.condition.notify_all()
+        finally:
+            cancelToken.removeCallback(self._wakeWaiting)
+        return boardID
+    
+    #returns the reason if the board has to be quarantined, None otherwise
+    def _releaseBoard(self, boardID, image, hadTimeout, result, fatalError = None):
+        quarantineTimeouts = self.DEFAULT_QUARANTINE_TIMEOUTS
+        if self.targetConfig.hasValue("httpsServer", "quarantineTimeouts"):
+            quarantineTimeouts = int(self.targetConfig.getValue("httpsServer", "quarantineTimeouts"))
+            
+        with self.condition:
+            state = self.boardStates[boardID]
+            state.lastImage = image
+            if hadTimeout:
+                state.lastTimeout = time.time()
+            if result == "timeout":
+                state.consecutiveTimeouts += 1
+            elif result in ("success", "fail"):
+                state.consecutiveTimeouts = 0
+                
+            reason = None
+            if fatalError != None:
+                reason = "fatal: " + str(fatalError)
+            elif state.consecutiveTimeouts >= quarantineTimeouts:
+                reason = "timeout: " + str(state.consecutiveTimeouts) + " requests in a row timed out"
+            if reason:
+                #quarantined before it is marked free, so no waiting request picks it
+                state.quarantined = True
+                state.quarantineReason = reason
+                state.quarantinedSince = time.time()
+            state.busy = False
+            self.condition.notify_all()
+        return reason
+    
+    #takes the board out of service, switches it off and schedules a probe
+    def _quarantine(self, boardID, reason):
+        sectionName = self.sectionNames[boardID]
+        print("quarantining " + sectionName + ", " + reason)
+        metrics.METRICS.increment("dachs_quarantines_total", reason = reason.split(":")[0], **self.targetConfig.getLabels(sectionName))
+        self._reportHealth(boardID)
+        try:
+            switch = self.targetConfig.getSwitch(self.targetConfig.getValue(sectionName, "switch"))
+            powerPort = int(self.targetConfig.getValue(sectionName, "powerport"))
+            switch.stopTimer(powerPort)
+            switch.switchOff(powerPort)
+        except Exception as E:
+            print("could not switch off " + sectionName + ": " + str(E))
+        self._scheduleProbe(boardID)
         
-        boardID = -1
-        for i in range(len(self.lockList)):
-            if self.lockList[i].acquire(blocking = False):
-                boardID = i
-                break
+    def _scheduleProbe(self, boardID):
+        probeInterval = self.DEFAULT_PROBE_INTERVAL
+        if self.targetConfig.hasValue("httpsServer", "probeInterval"):
+            probeInterval = int(self.targetConfig.getValue("httpsServer", "probeInterval"))
+        timer = threading.Timer(probeInterval, self._probe, [boardID])
+        timer.daemon = True
+        timer.start()
+        
+    #power cycles a quarantined board and asks the target whether it is usable again
+    def _probe(self, boardID):
+        sectionName = self.sectionNames[boardID]
+        try:
+            switch = self.targetConfig.getSwitch(self.targetConfig.getValue(sectionName, "switch"))
+            powerPort = int(self.targetConfig.getValue(sectionName, "powerport"))
+            switch.restart(powerPort)
+            healthy = self.handlerClassName.probe(self.targetConfig, sectionName)
+            switch.switchOff(powerPort)
+        except Exception as E:
+            print("probing " + sectionName + " failed: " + str(E))
+            healthy = False
             
-        if boardID == -1:
-            raise IndexError("boardID out of range")
+        if not healthy:
+            self._scheduleProbe(boardID)
+            return
         
-        config = configparser.ConfigParser()
-        config.read(clientConfigFile)
+        print(sectionName + " is back in service")
+        with self.condition:
+            state = self.boardStates[boardID]
+            state.quarantined = False
+            state.quarantineReason = None
+            state.quarantinedSince = None
+            state.consecutiveTimeouts = 0
+            state.lastTimeout = time.time()
+            self.condition.notify_all()
+        self._reportHealth(boardID)
+        
+    def _reportHealth(self, boardID):
+        state = self.boardStates[boardID]
+        labels = self.targetConfig.getLabels(state.sectionName)
+        metrics.METRICS.setGauge("dachs_board_healthy", 0 if state.quarantined else 1, **labels)
+        metrics.METRICS.setBoardHealth(state.sectionName, **state.healthReport())
+            
+    def _estimateTimeout(self, exeHash, architecture, board, clientTimeout):
+        history = self.targetConfig.history
+        if not history or not self.targetConfig.hasValue("httpsServer", "historyTimeoutFactor"):
+            return clientTimeout
+        factor = float(self.targetConfig.getValue("httpsServer", "historyTimeoutFactor"))
+        minimumNumRuns = 3
+        if self.targetConfig.hasValue("httpsServer", "historyMinimumRuns"):
+            minimumNumRuns = int(self.targetConfig.getValue("httpsServer", "historyMinimumRuns"))
+        maximumRunTime = history.maximumRunTime(exeHash, architecture, board, minimumNumRuns)
+        if maximumRunTime == None:
+            return clientTimeout
+        return min(clientTimeout, int(math.ceil(factor * maximumRunTime)) + 1)
+        
+    #fileInput is the executable as artifacts.Artifact, config the parsed client configuration
+    def handle(self, fileInput, config, exeHash = None, cancelToken = None):
+        if not cancelToken:
+            cancelToken = CancelToken()
+        architecture = config["Target"]["architecture"]
+        board = config["Target"]["board"]
+        
+        history = self.targetConfig.history
+        expectedRunTime = None
+        if (history or self.handlerClassName.IMAGE_REUSE) and not exeHash:
+            exeHash = historyModule.hashBuffer(fileInput.getbuffer())
+        if history:
+            expectedRunTime = history.expectedRunTime(exeHash, architecture, board)
+            if expectedRunTime == None:
+                expectedRunTime = history.averageRunTime(architecture, board)
+            
+            clientTimeout = config["Config"].getint("timeout")
+            timeout = self._estimateTimeout(exeHash, architecture, board, clientTimeout)
+            if timeout != clientTimeout:
+                print("timeout reduced from " + str(clientTimeout) + " to " + str(timeout) + " based on the run history")
+                config["Config"]["timeout"] = str(timeout)
+        
+        #a board failing fatally is quarantined and the request runs on another board
+        while True:
+            outcome = self._handleOnBoard(fileInput, config, exeHash, expectedRunTime, cancelToken)
+            if outcome != None:
+                return outcome
+            print("requeueing request")
+        
+    #returns (output, result), or None if the board failed and was quarantined
+    def _handleOnBoard(self, fileInput, config, exeHash, expectedRunTime, cancelToken):
+        architecture = config["Target"]["architecture"]
+        board = config["Target"]["board"]
+        groupLabels = {"architecture": architecture, "board": board}
+        history = self.targetConfig.history
+        
+        print("now: acquire")
+        queueStart = time.time()
+        boardID = self._acquireBoard(self._priority(expectedRunTime), exeHash, cancelToken)
+        queueWait = time.time() - queueStart
         
         switchName = self.targetConfig.getValue(self.sectionNames[boardID], "switch")
         switch = self.targetConfig.getSwitch(switchName)
         powerPort = int(self.targetConfig.getValue(self.sectionNames[boardID], "powerport"))
+        labels = self.targetConfig.getLabels(self.sectionNames[boardID])
+        diagnostics.updateContext(target = self.sectionNames[boardID])
+        metrics.METRICS.observe("dachs_queue_wait_seconds", queueWait, **groupLabels)
+        metrics.METRICS.boardBusy(**labels)
         
-        deviceHandler = self.handlerClassName(fileInput, clientConfigFile, boardID, self.targetConfig, self.sectionNames[boardID])
-        myStateMachine = StateMachine(self.targetConfig, deviceHandler, config["Config"].getint("retryMaximum"), switch, powerPort)
-        
-        switch.stopTimer(powerPort)
-        switch.switchOn(powerPort)
-        
+        output = None
+        myStateMachine = None
+        verdict = None
+        result = "error"
+        fatalError = None
         try:
+            deviceHandler = self.handlerClassName(fileInput, config, boardID, self.targetConfig, self.sectionNames[boardID])
+            myStateMachine = StateMachine(self.targetConfig, deviceHandler, config["Config"].getint("retryMaximum"), switch, powerPort, labels, cancelToken)
+            
+            switch.stopTimer(powerPort)
+            switch.switchOn(powerPort)
+            
             print("started the test")
             output = myStateMachine.run()
+            verdict = myStateMachine.verdict
+            if output and verdict and verdict[0] == patterns.FAIL:
+                result = "fail"
+                output = self._appendLine(output, "[dachs] test failed, matched '" + verdict[1] + "'")
+            elif output:
+                result = "success"
+            elif myStateMachine.cancelled:
+                result = "cancelled"
+            else:
+                result = "timeout"
+            #runs without output get a summary as well, it names the test that hung
+            if results.createParser(config["Config"]):
+                output = self._structuredOutput(deviceHandler, output, result, verdict, config["Config"])
+        except FatalException as FE:
+            print(type(FE))
+            print(FE)
+            fatalError = FE
         finally:
-            self.lockList[boardID].release()
-            self.sema.release()
-            switch.startTimer(powerPort)
+            hadTimeout = myStateMachine != None and myStateMachine.numTimeouts > 0
+            quarantineReason = self._releaseBoard(boardID, exeHash if result == "success" else None, hadTimeout, result, fatalError)
+            if quarantineReason:
+                self._quarantine(boardID, quarantineReason)
+            else:
+                switch.startTimer(powerPort)
+            metrics.METRICS.boardIdle(**labels)
+            metrics.METRICS.increment("dachs_requests_total", result = result, **groupLabels)
+            if history and myStateMachine:
+                history.record(exeHash, architecture, board, self.sectionNames[boardID], queueWait,
+                               myStateMachine.stateDurations.get(StateMachine.DEVICE_SELECTED, 0),
+                               myStateMachine.lastRunTime, myStateMachine.numTimeouts, result)
             
         print("release")
         
-        if output:
+        #a cancelled run with a structured result is answered with its summary
+        if (result == "cancelled" and not output) or (fatalError != None and cancelToken.isCancelled()):
+            raise RequestCancelledException("Request cancelled while running on " + self.sectionNames[boardID])
+        if fatalError != None:
+            return None
+        return (output, result)
+    
+    #handlers that parse the serial output while it arrives provide their
+    #resultParser, the output of any other handler is parsed once it is complete,
+    #output is None if the run timed out or was cancelled
+    def _structuredOutput(self, deviceHandler, output, result, verdict, section):
+        resultParser = getattr(deviceHandler, "resultParser", None)
+        if resultParser == None:
+            resultParser = results.ResultParser()
+            if output:
+                for chunk in (output.chunks() if isinstance(output, spool.SpooledOutput) else [str(output).encode()]):
+                    resultParser.feed(chunk)
+        summary = results.render(resultParser.summary(result, verdict))
+        if not output or not section.getboolean("fullLog", fallback = False):
+            if isinstance(output, spool.SpooledOutput):
+                output.close()
+            return summary
+        if isinstance(output, spool.SpooledOutput):
+            structuredOutput = spool.SpooledOutput(output.threshold, self.targetConfig.getValue("httpsServer", "pathToDir"))
+            structuredOutput.write(summary.encode())
+            structuredOutput.append(output)
+            output.close()
+            return structuredOutput
+        return summary + str(output)
+    
+    def _appendLine(self, output, line):
+        if isinstance(output, spool.SpooledOutput):
+            output.write(("\n" + line + "\n").encode())
             return output
-        else:
-            return "The test timed out too often"
+        return str(output) + "\n" + line + "\n"
     
 class TargetConfiguration:
-    def __init__(self, cfgFileName):
+    #groupKeys restricts the configuration to these (architecture, board) groups,
+    #e.g. the ones owned by a worker process
+    def __init__(self, cfgFileName, groupKeys = None):
         self.cfgFileName = cfgFileName
+        self.groupKeys = groupKeys
+        memoryLimit = artifacts.DEFAULT_MEMORY_LIMIT
+        if self.hasValue("httpsServer", "artifactMemoryLimit"):
+            memoryLimit = int(self.getValue("httpsServer", "artifactMemoryLimit"))
+        self.artifactStore = artifacts.ArtifactStore(self.getValue("httpsServer", "pathToDir"), memoryLimit)
         self.targetHandlerGroupDict = self._generateTargetHandlerGroupDict()
         self.switches = None
+        self.history = None
+        self.resultCache = None
         
     def getValue(self, section, attributeName):
         cfg = configparser.ConfigParser()
         cfg.read(self.cfgFileName)
         return cfg[section][attributeName]
+    
+    def hasValue(self, section, attributeName):
+        cfg = configparser.ConfigParser()
+        cfg.read(self.cfgFileName)
+        return cfg.has_option(section, attributeName)
+    
+    def getSchedulingPolicy(self):
+        if self.hasValue("httpsServer", "schedulingPolicy"):
+            return self.getValue("httpsServer", "schedulingPolicy")
+        return TargetHandlerGroup.FIFO
+    
+    def getLabels(self, section):
+        return {"architecture": self.getValue(section, "architecture"), "board": self.getValue(section, "board"), "target": section}
             
     def _generateTargetHandlerGroupDict(self):
         targetString = self.getValue("httpsServer", "targets")
@@ -268,6 +722,8 @@ class TargetConfiguration:
             t = t.strip(" ")
             board = self.getValue(t, "board")
             arch = self.getValue(t, "architecture")
+            if self.groupKeys != None and (arch, board) not in self.groupKeys:
+                continue
             try:
                 targetHandlerGroup = targetDict[(arch, board)]
             except KeyError:
@@ -285,12 +741,29 @@ class TargetConfiguration:
         
     def getTargetHandlerGroup(self, key):
         return self.targetHandlerGroupDict[key]
+    
+    def getTargetHandlerGroupKeys(self):
+        return sorted(self.targetHandlerGroupDict.keys())
+    
+    #replaces the groups, e.g. by proxies for groups owned by worker processes
+    def setTargetHandlerGroups(self, targetHandlerGroupDict):
+        self.targetHandlerGroupDict = targetHandlerGroupDict
+        
+    def getSwitchNames(self, groupKey):
+        group = self.targetHandlerGroupDict[groupKey]
+        return sorted(set(self.getValue(sectionName, "switch").strip() for sectionName in group.sectionNames))
         
     def setSwitches(self, switches):
         self.switches = switches
         
     def getSwitch(self, switchName):
         return self.switches[switchName]
+    
+    def setHistory(self, history):
+        self.history = history
+        
+    def setResultCache(self, resultCache):
+        self.resultCache = resultCache
    
     
 class ClientHandlerException(Exception):
@@ -298,64 +771,141 @@ class ClientHandlerException(Exception):
         Exception.__init__(self, *args, **kwargs)
     
 class ClientHandler:
+    CACHE_MARKER = "[dachs] served from cache, result of "
+    
     def __init__(self, targetConfig):
         self.targetConfig = targetConfig
         self.counter = 0
         
-    def handleClient(self, fileInput, clientConfigFile):
-        config = configparser.ConfigParser()
-        config.read(clientConfigFile)
-        
+    def handleClient(self, fileInput, config, cancelToken = None):
         try:
             thGroup = self.targetConfig.getTargetHandlerGroup((config["Target"]["architecture"], config["Target"]["board"]))
         except KeyError:
             raise ClientHandlerException("This (architecture, board) tuple does not exist")
+        
+        resultCache = self.targetConfig.resultCache
+        useCache = resultCache and config["Config"].getboolean("cacheable", fallback = False)
+        exeHash = None
+        if useCache:
+            exeHash = historyModule.hashBuffer(fileInput.getbuffer())
+            cacheKey = self._cacheKey(exeHash, config)
+            if not config["Config"].getboolean("bypassCache", fallback = False):
+                cached = resultCache.get(cacheKey)
+                if cached:
+                    output, storeTime = cached
+                    print("served from cache")
+                    metrics.METRICS.increment("dachs_cache_requests_total", result = "hit", architecture = config["Target"]["architecture"], board = config["Target"]["board"])
+                    return self.CACHE_MARKER + time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(storeTime)) + "\n" + output
+            metrics.METRICS.increment("dachs_cache_requests_total", result = "miss", architecture = config["Target"]["architecture"], board = config["Target"]["board"])
                 
-        return thGroup.handle(fileInput, clientConfigFile)
+        output, result = thGroup.handle(fileInput, config, exeHash, cancelToken)
+        if not output:
+            return "The test timed out too often"
+        
+        #spooled outputs are only read into memory if the cache can hold them
+        if useCache and result == "success" and len(output) <= resultCache.maxSize:
+            resultCache.put(cacheKey, str(output))
+        return output
+    
+    def resolveTargets(self, matrix):
+        keys = []
+        for target in matrix.split(","):
+            try:
+                architecture, board = target.strip().split("/")
+            except ValueError:
+                raise ClientHandlerException("Targets of a matrix request must be given as architecture/board: " + target)
+            matches = [k for k in self.targetConfig.getTargetHandlerGroupKeys()
+                       if fnmatch.fnmatchcase(k[0], architecture) and fnmatch.fnmatchcase(k[1], board)]
+            if not matches:
+                raise ClientHandlerException("No (architecture, board) tuple matches " + target.strip())
+            for key in matches:
+                if key not in keys:
+                    keys.append(key)
+        return keys
+    
+    #only the parts of the client configuration that influence a successful output
+    def _cacheKey(self, exeHash, config):
+        return (exeHash, config["Target"]["architecture"], config["Target"]["board"], config["Config"]["endString"],
+                config["Config"].get("passPatterns", ""), config["Config"].get("failPatterns", ""),
+                config["Config"].get("resultFormat", ""), config["Config"].get("fullLog", ""))
             
             
-def parseXML(xmlFile, pathForTmp):
-    doc = libxml2.parseFile(xmlFile.name)
-    context = doc.xpathNewContext()
-    
-    exeMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Executable"))
-    architectureMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Target/Architecture"))
-    boardMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Target/Board"))
-    retryMaximumMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/RetryMaximum"))
-    timeoutMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Timeout"))
-    endStringMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/EndString"))
-    serialTimeoutMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/SerialTimeout"))
-    
-    exeFile = tempfile.NamedTemporaryFile(suffix = ".exe", delete = True, dir = pathForTmp)
-    cfgFile = tempfile.NamedTemporaryFile(suffix = ".ini", delete = True, dir = pathForTmp)
-    
-    with open(exeFile.name, "w+b") as exeF:
-        exeF.write(base64.b64decode(str(list(exeMap))))
-                   
-    with open(cfgFile.name, "w") as cfgF:
-        cfgF.write("[Target]\narchitecture=")
-        cfgF.write(str(list(architectureMap)[0]))
-        cfgF.write("\nboard=")
-        cfgF.write(str(list(boardMap)[0]))
-        cfgF.write("\n[Config]\nretryMaximum=")
-        cfgF.write(str(list(retryMaximumMap)[0]))
-        cfgF.write("\ntimeout=")
-        cfgF.write(str(list(timeoutMap)[0]))
-        cfgF.write("\nendString=")
-        cfgF.write(str(list(endStringMap)[0]))
-        cfgF.write("\nserialTimeout=")
-        cfgF.write(str(list(serialTimeoutMap)[0]))
-        cfgF.write("\n")
-        
-    return (exeFile, cfgFile)
+#returns the executable as artifact and the parsed client configuration
+def parseXML(xmlData, artifactStore):
+    doc = libxml2.parseMemory(xmlData, len(xmlData))
+    try:
+        context = doc.xpathNewContext()
+    
+        exeMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Executable"))
+        architectureList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Target/Architecture")))
+        boardList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Target/Board")))
+        retryMaximumMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/RetryMaximum"))
+        timeoutMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Timeout"))
+        endStringMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/EndString"))
+        serialTimeoutMap = map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/SerialTimeout"))
+        cacheableList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Cacheable")))
+        bypassCacheList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/BypassCache")))
+        compressionList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/Compression")))
+        silenceTimeoutList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/SilenceTimeout")))
+        resultFormatList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/ResultFormat")))
+        fullLogList = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/FullLog")))
+        patternLists = {}
+        for key, element in (("passPatterns", "PassPattern"), ("failPatterns", "FailPattern"), ("hangPatterns", "HangPattern")):
+            patternLists[key] = list(map(libxml2.xmlNode.getContent, context.xpathEval("/ExecutionRequest/" + element)))
+    
+        #interpolation is disabled, patterns may contain '%'
+        config = configparser.ConfigParser(interpolation = None)
+        config["Target"] = {"architecture": str(architectureList[0]), "board": str(boardList[0])}
+        #several targets or wildcards make a matrix request
+        targets = [str(a) + "/" + str(b) for a, b in zip(architectureList, boardList)]
+        if len(targets) > 1 or any(c in t for t in targets for c in "*?["):
+            config["Target"]["matrix"] = ", ".join(targets)
+        config["Config"] = {"retryMaximum": str(list(retryMaximumMap)[0]),
+                            "timeout": str(list(timeoutMap)[0]),
+                            "endString": str(list(endStringMap)[0]),
+                            "serialTimeout": str(list(serialTimeoutMap)[0])}
+        if cacheableList:
+            config["Config"]["cacheable"] = str(cacheableList[0])
+        if bypassCacheList:
+            config["Config"]["bypassCache"] = str(bypassCacheList[0])
+        if compressionList:
+            config["Config"]["compression"] = str(compressionList[0])
+        if silenceTimeoutList:
+            config["Config"]["silenceTimeout"] = str(silenceTimeoutList[0])
+        if resultFormatList:
+            config["Config"]["resultFormat"] = str(resultFormatList[0])
+        if fullLogList:
+            config["Config"]["fullLog"] = str(fullLogList[0])
+        #one pattern per line
+        for key, patternList in sorted(patternLists.items()):
+            if patternList:
+                config["Config"][key] = "\n".join(str(pattern) for pattern in patternList)
+    
+        #the executable is decoded last, nothing has to be cleaned up if the request is malformed
+        exeFile = artifactStore.fromBytes(base64.b64decode(str(list(exeMap))), ".exe")
+        return (exeFile, config)
+    finally:
+        doc.freeDoc()
+
+#every target of a matrix request gets its own copy of the client configuration,
+#the executable is only read and shared by all of them
+def splitRequest(config, key):
+    targetConfig = configparser.ConfigParser(interpolation = None)
+    targetConfig.read_dict(config)
+    targetConfig["Target"]["architecture"] = key[0]
+    targetConfig["Target"]["board"] = key[1]
+    targetConfig.remove_option("Target", "matrix")
+    return targetConfig
 
-def initializeSwitch(targetConfig):
+def initializeSwitch(targetConfig, switchNames = None):
     switchString = targetConfig.getValue("httpsServer", "switches")
     switchList = switchString.split(",")
     
     switchDict = {}
     for s in switchList:
         s  = s.strip()
+        if switchNames != None and s not in switchNames:
+            continue
         switchHandlerString = targetConfig.getValue(s, "switchHandler")
         moduleClass = switchHandlerString.split(".")
         module = importlib.import_module(moduleClass[0])
@@ -366,57 +916,262 @@ def initializeSwitch(targetConfig):
     return switchDict
     
     
-@asyncio.coroutine 
-def handleClient(websocket, path):
+#clients that announce zlib get the output as one zlib stream, split into
+#binary frames and terminated by an empty frame
+@asyncio.coroutine
+def sendOutput(websocket, output, compression):
+    if compression == "zlib":
+        if isinstance(output, spool.SpooledOutput):
+            chunks = output.compressedChunks()
+        else:
+            chunks = spool.compressedChunks(io.BytesIO(str(output).encode()))
+        for chunk in chunks:
+            if chunk:
+                yield from websocket.send(chunk)
+        yield from websocket.send(b"")
+    else:
+        yield from websocket.send(str(output))
     
-    print("Starting")
-    inputStream = yield from websocket.recv()
-    print("received file")
     
-    global CLIENT_HANDLER
-    global TARGET_CONFIG
+#the text sent to the client for an exception that ended its request
+def exceptionOutput(exception):
+    if isinstance(exception, RequestCancelledException):
+        print(exception)
+        return str(exception)
+    if isinstance(exception, RequestRejectedException):
+        print("request rejected, " + str(exception))
+        output = "[dachs] request rejected, " + str(exception) + ", "
+        if exception.estimatedWait != None:
+            output += "estimated wait " + str(exception.estimatedWait) + " seconds, "
+        return output + "retry later\n"
+    print(type(exception))
+    print(exception)
+    if isinstance(exception, FatalException):
+        #failing boards are quarantined by their TargetHandlerGroup, the server keeps running
+        return str(type(exception)) + "\n" + str(exception) + "\n\nFatal Exception\nrequest terminated"
+    if isinstance(exception, StateMachineException):
+        return str(type(exception)) + "\n" + str(exception) + "\n\n\nStatemachine failed"
+    return str(type(exception)) + "\n" + str(exception) + "\nrequest terminated"
     
-    pathToDir = TARGET_CONFIG.getValue("httpsServer", "pathToDir")
     
-    inputTmpFile = tempfile.NamedTemporaryFile(suffix = ".xml", delete = True, dir = pathToDir)
-    with open(inputTmpFile.name, "w+b") as iFile:
-        iFile.write(inputStream)
+@asyncio.coroutine
+def handleTarget(executor, executable, clientCfg, requestID, cancelToken):
+    context = {"request": requestID, "architecture": clientCfg["Target"]["architecture"], "board": clientCfg["Target"]["board"]}
+    try:
+        output = yield from asyncio.get_event_loop().run_in_executor(executor, functools.partial(diagnostics.runWithContext, context, CLIENT_HANDLER.handleClient, executable, clientCfg, cancelToken))
+    except Exception as E:
+        #any failure, e.g. of a switch or the serial interface, only ends this
+        #target, the other targets of a matrix request and the connection go on
+        output = exceptionOutput(E)
+    return output
+
+
+#runs the request on all matching target groups concurrently, the outputs
+#are concatenated, each one headed by its target
+@asyncio.coroutine
+def handleMatrix(executor, executable, config, pathToDir, requestID, cancelToken):
+    keys = CLIENT_HANDLER.resolveTargets(config["Target"]["matrix"])
+    requests = [splitRequest(config, key) for key in keys]
+    try:
+        outputs = yield from asyncio.gather(*[handleTarget(executor, executable, c, requestID, cancelToken) for c in requests])
+    except BaseException:
+        #e.g. the connection handler was cancelled, the other targets must not keep their boards
+        cancelToken.cancel()
+        raise
     
-    resultList = parseXML(inputTmpFile, pathToDir)
-    executable = resultList[0]
-    clientCfg = resultList[1]
+    threshold = spool.DEFAULT_SPOOL_THRESHOLD
+    if TARGET_CONFIG.hasValue("httpsServer", "outputSpoolThreshold"):
+        threshold = int(TARGET_CONFIG.getValue("httpsServer", "outputSpoolThreshold"))
+    matrixOutput = spool.SpooledOutput(threshold, pathToDir)
+    for key, output in zip(keys, outputs):
+        matrixOutput.write(("=== " + key[0] + "/" + key[1] + " ===\n").encode())
+        matrixOutput.append(output)
+        matrixOutput.write(b"\n")
+        if isinstance(output, spool.SpooledOutput):
+            output.close()
+    return matrixOutput
     
-    executor = concurrent.futures.ThreadPoolExecutor()
-    output = None
     
+#the sequence number of a "cancel <sequence>" message, None for other messages,
+#the requests of a connection are numbered from 0 in the order they arrive
+def cancelledSequence(message):
+    if isinstance(message, str) and message.startswith("cancel "):
+        try:
+            return int(message[len("cancel "):])
+        except ValueError:
+            pass
+    return None
+    
+    
+def requestedGroups(config):
+    if config.has_option("Target", "matrix"):
+        return CLIENT_HANDLER.resolveTargets(config["Target"]["matrix"])
+    return [(config["Target"]["architecture"], config["Target"]["board"])]
+
 
+#answers an "admit architecture/board, ..." message sent before a request,
+#returns the reply and the admitted groups, which the next request of the
+#connection may use
+def admitTargets(targets):
     try:
-        #add param for configFileName, input, let's see if syntactically correct
-        output = yield from asyncio.get_event_loop().run_in_executor(executor, functools.partial(CLIENT_HANDLER.handleClient, executable, clientCfg.name))
-    except FatalException as CIException:
-        print(type(CIException))
-        print(CIException)
-        output = str(type(CIException)) + "\n" + str(CIException) + "\n\nFatal Exception\nSwitching off device\nDisable server"
-        yield from websocket.send(str(output))
-        print("Exiting")
-        #TODO switch off all switches
-        #whether everything should be switched off needs consideration
-        #should failure of one boards cause everything to shut down?
-        print("Unnexcpected failure, shutting down server. Currently, no switches are shut down. Consider changing this implementation.")
-        sys.exit(1)
-    except StateMachineException as SME:
-        print(type(SME))
-        print(SME)
-        output = str(type(SME)) + "\n" + str(SME) + "\n\n\nStatemachine failed"
+        groupKeys = CLIENT_HANDLER.resolveTargets(targets)
     except ClientHandlerException as CHE:
-        print(type(CHE))
-        print(CHE)
-        output = str(type(CHE)) + "\n" + str(CHE) + "\nrequest terminated"
+        return ("rejected unknown " + str(CHE), None)
+    rejection = ADMISSION.admit(groupKeys)
+    if rejection:
+        estimatedWait = ADMISSION.estimateWait(groupKeys)
+        return ("rejected " + (str(estimatedWait) if estimatedWait != None else "unknown") + " " + rejection, None)
+    return ("admitted", groupKeys)
+    
+    
+#answers an "admin <token> <command>" message, see diagnostics.handleCommand,
+#admin commands are refused unless the server has an adminToken
+def handleAdmin(message):
+    words = message.split(None, 2)
+    if not TARGET_CONFIG.hasValue("httpsServer", "adminToken"):
+        return "admin commands disabled"
+    if len(words) < 3 or not hmac.compare_digest(words[1].encode(), TARGET_CONFIG.getValue("httpsServer", "adminToken").encode()):
+        print("admin command with wrong token refused")
+        return "admin token invalid"
+    print("admin command: " + words[2])
+    return diagnostics.handleCommand(words[2])
+    
+    
+#returns the output of the request and the compression the client asked for
+@asyncio.coroutine 
+def handleRequest(inputStream, reservation, cancelToken):
+    
+    global CLIENT_HANDLER
+    global TARGET_CONFIG
+    
+    pathToDir = TARGET_CONFIG.getValue("httpsServer", "pathToDir")
+    
+    output = None
+    executable = None
+    compression = None
+    requestID = next(REQUEST_IDS)
+    
+    #everything that may fail is inside, so that the reservation is released
+    #and the client gets an answer
+    try:
+        try:
+            executable, config = parseXML(inputStream, TARGET_CONFIG.artifactStore)
+        except (libxml2.parserError, IndexError, KeyError, TypeError, ValueError) as E:
+            raise ClientHandlerException("Malformed execution request: " + str(E))
+        metrics.METRICS.observe("dachs_upload_bytes", len(inputStream), architecture = config["Target"]["architecture"], board = config["Target"]["board"])
+        compression = config["Config"].get("compression")
+        
+        #a request without a matching admission is checked now and rejected right away
+        groupKeys = requestedGroups(config)
+        if reservation != groupKeys:
+            if reservation:
+                ADMISSION.release(reservation)
+            reservation = None
+            rejection = ADMISSION.admit(groupKeys)
+            if rejection:
+                raise RequestRejectedException(rejection, ADMISSION.estimateWait(groupKeys))
+            reservation = groupKeys
+        
+        if config.has_option("Target", "matrix"):
+            output = yield from handleMatrix(EXECUTOR, executable, config, pathToDir, requestID, cancelToken)
+        else:
+            output = yield from handleTarget(EXECUTOR, executable, config, requestID, cancelToken)
+    except Exception as E:
+        #e.g. the admission or the targets of a matrix request
+        cancelToken.cancel()
+        output = exceptionOutput(E)
     finally:
-        executable.close()
-        clientCfg.close()
+        if executable != None:
+            executable.close()
+        if reservation:
+            ADMISSION.release(reservation)
+    
+    print("\n\nFinished handling request!\n\n")
+    return (output, compression)
     
-    yield from websocket.send(str(output))
+    
+@asyncio.coroutine
+def handleAdminMessage(message):
+    #profiling stops by joining the sampling thread, so it does not run in the event loop
+    reply = yield from asyncio.get_event_loop().run_in_executor(None, handleAdmin, message)
+    return (reply, None)
+    
+    
+#sends the answers of a connection in the order of the requests, each one
+#once it is finished, answers is a queue of futures and ends with None
+@asyncio.coroutine
+def sendAnswers(websocket, answers):
+    while True:
+        answer = yield from answers.get()
+        if answer == None:
+            break
+        output, compression = yield from answer
+        try:
+            if websocket.open:
+                yield from sendOutput(websocket, output, compression)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            if isinstance(output, spool.SpooledOutput):
+                output.close()
+    
+    
+#a client may keep the connection open and send several requests one after
+#another or pipelined, pipelined requests run concurrently, e.g. on the free
+#boards of a group, and the outputs are sent back in the order of the requests
+@asyncio.coroutine 
+def handleClient(websocket, path):
+    
+    print("Starting")
+    answers = asyncio.Queue()
+    sender = asyncio.ensure_future(sendAnswers(websocket, answers))
+    #the cancel tokens of the running requests by sequence number
+    running = {}
+    reservation = None
+    sequence = 0
+    try:
+        while True:
+            try:
+                message = yield from websocket.recv()
+            except websockets.exceptions.ConnectionClosed:
+                break
+            cancelled = cancelledSequence(message)
+            if cancelled != None:
+                #a cancel for a request that already finished is ignored
+                if cancelled in running:
+                    print("client cancelled request")
+                    running[cancelled].cancel()
+                continue
+            if isinstance(message, str) and message.startswith("admit "):
+                if reservation:
+                    ADMISSION.release(reservation)
+                reply, reservation = admitTargets(message[len("admit "):])
+                answer = asyncio.Future()
+                answer.set_result((reply, None))
+                answers.put_nowait(answer)
+                continue
+            if isinstance(message, str) and message.startswith("admin "):
+                answers.put_nowait(asyncio.ensure_future(handleAdminMessage(message)))
+                continue
+            print("received file")
+            #the request takes over the reservation and releases it
+            requestReservation, reservation = reservation, None
+            cancelToken = CancelToken()
+            running[sequence] = cancelToken
+            request = asyncio.ensure_future(handleRequest(message, requestReservation, cancelToken))
+            request.add_done_callback(functools.partial(lambda s, r: running.pop(s, None), sequence))
+            answers.put_nowait(request)
+            sequence += 1
+    finally:
+        #requests of a closed connection are cancelled, their boards are released
+        if running:
+            print("client disconnected, cancelling " + str(len(running)) + " requests")
+        for cancelToken in list(running.values()):
+            cancelToken.cancel()
+        answers.put_nowait(None)
+        yield from sender
+        if reservation:
+            ADMISSION.release(reservation)
     
     print("\n\nFinished handling client!\n\n")
     
@@ -435,19 +1190,48 @@ if __name__ == "__main__":
     config.read(configFileName)
     
     TARGET_CONFIG = TargetConfiguration(configFileName)
+    diagnostics.installSignalHandlers(TARGET_CONFIG.getValue("httpsServer", "pathToDir"))
     
-    switches = initializeSwitch(TARGET_CONFIG)
-    TARGET_CONFIG.setSwitches(switches)
+    #with workers, the boards and switches are driven by the worker processes
+    numWorkers = config["httpsServer"].getint("workers", 0)
+    if numWorkers > 0:
+        workerPool = workers.WorkerPool(configFileName, TARGET_CONFIG, numWorkers)
+        workerPool.start()
+        TARGET_CONFIG.setTargetHandlerGroups(workerPool.getTargetHandlerGroups())
+    else:
+        switches = initializeSwitch(TARGET_CONFIG)
+        TARGET_CONFIG.setSwitches(switches)
+    
+    if TARGET_CONFIG.hasValue("httpsServer", "historyFile"):
+        TARGET_CONFIG.setHistory(historyModule.RunHistory(TARGET_CONFIG.getValue("httpsServer", "historyFile")))
+        
+    if TARGET_CONFIG.hasValue("httpsServer", "resultCacheSize"):
+        cacheSize = int(TARGET_CONFIG.getValue("httpsServer", "resultCacheSize"))
+        cacheTimeToLive = int(TARGET_CONFIG.getValue("httpsServer", "resultCacheTTL"))
+        TARGET_CONFIG.setResultCache(cache.ResultCache(cacheSize, cacheTimeToLive))
     
     CLIENT_HANDLER = ClientHandler(TARGET_CONFIG)
     
+    maxPending = config["httpsServer"].getint("maxPendingRequests", admission.DEFAULT_MAX_PENDING_REQUESTS)
+    maxQueuedPerGroup = config["httpsServer"].getint("maxQueuedPerGroup", None)
+    ADMISSION = admission.AdmissionControl(TARGET_CONFIG, maxPending, maxQueuedPerGroup)
+    EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers = maxPending)
+    
     certificate = TARGET_CONFIG.getValue("httpsServer", "certName")
     ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
     ssl_context.load_cert_chain(certificate)
+    #session tickets let returning clients resume the TLS session instead of a full handshake
+    ssl_context.options &= ~ssl.OP_NO_TICKET
+    if hasattr(ssl_context, "num_tickets"):
+        ssl_context.num_tickets = config["httpsServer"].getint("tlsSessionTickets", 2)
     
     myPort = int(TARGET_CONFIG.getValue("httpsServer", "port"))
     maxSize = int(TARGET_CONFIG.getValue("httpsServer","maxSize"))
     serverTimeout = int(TARGET_CONFIG.getValue("httpsServer", "httpsServerTimeout"))
+    if config.has_option("httpsServer", "metricsPort"):
+        metricsAddress = config["httpsServer"].get("metricsAddress", "127.0.0.1")
+        metrics.metricsThread(metricsAddress, config["httpsServer"].getint("metricsPort")).start()
+    
     start_server = websockets.serve(handleClient, port = myPort, ssl = ssl_context, max_size = maxSize, timeout = serverTimeout)
 
     asyncio.get_event_loop().run_until_complete(start_server)
@@ -0,0 +1,222 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import http.server
+import json
+import threading
+import time
+
+COUNTER = "counter"
+GAUGE = "gauge"
+SUMMARY = "summary"
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+        self.types = {}
+        self.helpTexts = {}
+        self.values = {}
+        self.busySince = {}
+        self.boardHealth = {}
+        #latest snapshots of the worker processes, by worker
+        self.remoteSnapshots = {}
+
+    def describe(self, name, metricType, helpText):
+        with self.lock:
+            self.types[name] = metricType
+            self.helpTexts[name] = helpText
+
+    def increment(self, name, value = 1, **labels):
+        key = (name, self._labelKey(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def setGauge(self, name, value, **labels):
+        key = (name, self._labelKey(labels))
+        with self.lock:
+            self.values[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, self._labelKey(labels))
+        with self.lock:
+            count, total = self.values.get(key, (0, 0))
+            self.values[key] = (count + 1, total + value)
+
+    def boardBusy(self, **labels):
+        with self.lock:
+            self.busySince[self._labelKey(labels)] = time.time()
+
+    def boardIdle(self, **labels):
+        labelKey = self._labelKey(labels)
+        with self.lock:
+            startTime = self.busySince.pop(labelKey, None)
+            if startTime != None:
+                key = ("dachs_board_busy_seconds_total", labelKey)
+                self.values[key] = self.values.get(key, 0) + time.time() - startTime
+
+    def setBoardHealth(self, target, **health):
+        with self.lock:
+            self.boardHealth[target] = health
+            
+    def snapshot(self):
+        with self.lock:
+            return {"values": dict(self.values), "busySince": dict(self.busySince), "boardHealth": dict(self.boardHealth)}
+        
+    def mergeSnapshot(self, source, snapshot):
+        with self.lock:
+            self.remoteSnapshots[source] = snapshot
+            
+    #keeps the counters of a worker that is gone, so they do not drop when it is replaced
+    def retireSnapshot(self, source):
+        with self.lock:
+            snapshot = self.remoteSnapshots.pop(source, None)
+            if snapshot:
+                for key, value in snapshot["values"].items():
+                    if self.types.get(key[0], GAUGE) != GAUGE:
+                        self._add(self.values, key, value)
+                for labelKey, startTime in snapshot["busySince"].items():
+                    self._add(self.values, ("dachs_board_busy_seconds_total", labelKey), time.time() - startTime)
+                
+    def renderHealth(self):
+        with self.lock:
+            health = dict(self.boardHealth)
+            for snapshot in self.remoteSnapshots.values():
+                health.update(snapshot["boardHealth"])
+            return json.dumps(health, sort_keys = True, indent = 2) + "\n"
+
+    def render(self):
+        with self.lock:
+            now = time.time()
+            values = dict(self.values)
+            busySince = dict(self.busySince)
+            for snapshot in self.remoteSnapshots.values():
+                for key, value in snapshot["values"].items():
+                    if self.types.get(key[0], GAUGE) == GAUGE:
+                        values[key] = value
+                    else:
+                        self._add(values, key, value)
+                busySince.update(snapshot["busySince"])
+            #boards that are busy right now count towards the busy time as well
+            for labelKey, startTime in busySince.items():
+                key = ("dachs_board_busy_seconds_total", labelKey)
+                values[key] = values.get(key, 0) + now - startTime
+
+            uptime = max(now - self.startTime, 1e-9)
+            for (name, labelKey), value in list(values.items()):
+                if name == "dachs_board_busy_seconds_total":
+                    values[("dachs_board_utilization", labelKey)] = value / uptime
+
+            lines = []
+            for name in sorted(set(n for n, l in values.keys())):
+                metricType = self.types.get(name, GAUGE)
+                if name in self.helpTexts:
+                    lines.append("# HELP " + name + " " + self.helpTexts[name])
+                lines.append("# TYPE " + name + " " + metricType)
+                for (n, labelKey), value in sorted(values.items()):
+                    if n != name:
+                        continue
+                    if metricType == SUMMARY:
+                        lines.append(name + "_count" + self._formatLabels(labelKey) + " " + str(value[0]))
+                        lines.append(name + "_sum" + self._formatLabels(labelKey) + " " + repr(float(value[1])))
+                    else:
+                        lines.append(name + self._formatLabels(labelKey) + " " + repr(float(value)))
+        return "\n".join(lines) + "\n"
+
+    def _add(self, values, key, value):
+        if key not in values:
+            values[key] = value
+        elif isinstance(value, tuple):
+            values[key] = (values[key][0] + value[0], values[key][1] + value[1])
+        else:
+            values[key] = values[key] + value
+
+    def _labelKey(self, labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _formatLabels(self, labelKey):
+        if not labelKey:
+            return ""
+        pairs = []
+        for k, v in labelKey:
+            v = v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+            pairs.append(k + "=\"" + v + "\"")
+        return "{" + ",".join(pairs) + "}"
+
+
+METRICS = MetricsRegistry()
+METRICS.describe("dachs_state_seconds", SUMMARY, "Time spent in each state of the StateMachine")
+METRICS.describe("dachs_queue_wait_seconds", SUMMARY, "Time a request waited for a free board")
+METRICS.describe("dachs_upload_bytes", SUMMARY, "Size of the execution requests sent by clients")
+METRICS.describe("dachs_image_build_seconds", SUMMARY, "Time needed to process the executable into a bootable image")
+METRICS.describe("dachs_tftp_seconds", SUMMARY, "Time needed to transfer the image over tftp")
+METRICS.describe("dachs_tftp_bytes_total", COUNTER, "Bytes transferred over tftp")
+METRICS.describe("dachs_serial_bytes_total", COUNTER, "Bytes read from the serial interface of the boards")
+METRICS.describe("dachs_retries_total", COUNTER, "Number of retries after a timeout")
+METRICS.describe("dachs_restarts_total", COUNTER, "Number of restarts of a board by its switch")
+METRICS.describe("dachs_requests_total", COUNTER, "Number of finished requests by result")
+METRICS.describe("dachs_cache_requests_total", COUNTER, "Lookups in the result cache by result")
+METRICS.describe("dachs_board_busy_seconds_total", COUNTER, "Time a board was occupied by a request")
+METRICS.describe("dachs_board_utilization", GAUGE, "Fraction of the server uptime a board was occupied")
+METRICS.describe("dachs_board_healthy", GAUGE, "1 if the board serves requests, 0 if it is quarantined")
+METRICS.describe("dachs_quarantines_total", COUNTER, "Number of times a board was quarantined by reason")
+METRICS.describe("dachs_worker_restarts_total", COUNTER, "Number of times a crashed worker process was started again")
+METRICS.describe("dachs_pending_requests", GAUGE, "Requests accepted but not yet answered, a matrix request counts once per group")
+METRICS.describe("dachs_admission_rejections_total", COUNTER, "Requests rejected by the admission control by limit")
+METRICS.describe("dachs_image_shares_total", COUNTER, "Number of requests that used the image built for a concurrent request")
+METRICS.describe("dachs_image_build_seconds_saved_total", COUNTER, "Build time saved by sharing images")
+METRICS.describe("dachs_image_bytes_saved_total", COUNTER, "Bytes of image copies saved by sharing images")
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = METRICS.render().encode()
+            contentType = "text/plain; version=0.0.4"
+        elif self.path == "/health":
+            body = METRICS.renderHealth().encode()
+            contentType = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class metricsThread(threading.Thread):
+    def __init__(self, address, port):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.httpServer = http.server.HTTPServer((address, port), MetricsRequestHandler)
+
+    def run(self):
+        print("metrics available on port " + str(self.httpServer.server_port))
+        self.httpServer.serve_forever()
@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import collections
+
+PASS = "pass"
+FAIL = "fail"
+HANG = "hang"
+
+#if patterns of different verdicts end at the same byte, the worst one wins
+PRIORITY = {PASS: 0, HANG: 1, FAIL: 2}
+
+Match = collections.namedtuple("Match", ["verdict", "pattern", "end"])
+
+
+#Aho-Corasick automaton over the bytes of all patterns, so that the serial
+#stream is scanned once no matter how many patterns there are
+class PatternMatcher:
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.match = [None]
+        for verdict, pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for byte in pattern:
+                if byte not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.match.append(None)
+                    self.goto[state][byte] = len(self.goto) - 1
+                state = self.goto[state][byte]
+            self.match[state] = self._better(self.match[state], (verdict, pattern))
+        self._buildFailureLinks()
+        self.reset()
+        
+    def _better(self, a, b):
+        if a == None:
+            return b
+        if b == None:
+            return a
+        return b if PRIORITY[b[0]] > PRIORITY[a[0]] else a
+        
+    def _buildFailureLinks(self):
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for byte, nextState in self.goto[state].items():
+                queue.append(nextState)
+                fallback = self.fail[state]
+                while fallback and byte not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nextState] = self.goto[fallback].get(byte, 0)
+                self.match[nextState] = self._better(self.match[nextState], self.match[self.fail[nextState]])
+                
+    def reset(self):
+        self.state = 0
+        self.position = 0
+        
+    #returns the first match in the stream fed so far, its end is the offset
+    #in the whole stream
+    def feed(self, data):
+        state = self.state
+        for i, byte in enumerate(data):
+            while state and byte not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(byte, 0)
+            if self.match[state]:
+                self.state = state
+                self.position += i + 1
+                verdict, pattern = self.match[state]
+                return Match(verdict, pattern.decode(errors = "ignore"), self.position)
+        self.state = state
+        self.position += len(data)
+        return None
+    
+    
+def _patternList(section, key):
+    return [p.strip() for p in section.get(key, "").splitlines() if p.strip()]
+
+
+#builds the matcher for the [Config] section of a client configuration,
+#the endString is a pass pattern
+def createMatcher(section):
+    patterns = [(PASS, section["endString"].encode())]
+    for verdict, key in ((PASS, "passPatterns"), (FAIL, "failPatterns"), (HANG, "hangPatterns")):
+        patterns += [(verdict, p.encode()) for p in _patternList(section, key)]
+    return PatternMatcher(patterns)
@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import collections
+import json
+import re
+import threading
+import time
+
+JSON = "json"
+
+#lines of output kept as excerpt of a failed test
+EXCERPT_LINES = 20
+#longer lines, e.g. binary garbage on the serial line, are cut
+MAX_LINE_LENGTH = 1024
+
+RTEMS_BEGIN = re.compile(r"\*\*\* BEGIN OF TEST (.*?) \*\*\*")
+RTEMS_END = re.compile(r"\*\*\* END OF TEST (.*?) \*\*\*")
+RTEMS_STATE = re.compile(r"\*\*\* TEST STATE: (\S+)")
+TAP_PLAN = re.compile(r"^1\.\.(\d+)")
+#the test number is optional in TAP, but without it any "ok" printed by a test would count
+TAP_RESULT = re.compile(r"^(not )?ok\s+(\d+)\s*(?:-\s*)?([^#]*?)\s*(?:#\s*(SKIP|TODO)\b.*)?$", re.IGNORECASE)
+
+
+#collects the tests of the serial output line by line while it arrives,
+#RTEMS tests are framed by their BEGIN and END markers, TAP results are
+#taken as they are, both may appear in the same output
+class ResultParser:
+    def __init__(self):
+        #after a timeout the summary is made while the read thread may still feed it
+        self.lock = threading.Lock()
+        self.reset()
+        
+    def reset(self):
+        with self.lock:
+            self._reset()
+            
+    def _reset(self):
+        self.startTime = time.time()
+        self.partialLine = b""
+        self.tests = []
+        self.plan = None
+        self.numTapResults = 0
+        self.currentTest = None
+        self.recentLines = collections.deque(maxlen = EXCERPT_LINES)
+        self.lastTapTime = 0.0
+        #the failed TAP test its diagnostic lines belong to
+        self.diagnosticsTest = None
+        
+    def feed(self, data):
+        with self.lock:
+            lines = (self.partialLine + data).split(b"\n")
+            self.partialLine = lines.pop()[:MAX_LINE_LENGTH]
+            now = time.time() - self.startTime
+            for line in lines:
+                self._parseLine(line[:MAX_LINE_LENGTH].decode(errors = "replace").rstrip("\r"), now)
+            
+    def _parseLine(self, line, now):
+        self.recentLines.append(line)
+        begin = RTEMS_BEGIN.search(line)
+        if begin:
+            self._finishCurrentTest(now)
+            self.currentTest = {"name": begin.group(1), "verdict": "fail", "start": round(now, 3)}
+            self.tests.append(self.currentTest)
+            self.recentLines.clear()
+            return
+        end = RTEMS_END.search(line)
+        if end and self.currentTest and self.currentTest["name"] == end.group(1):
+            self.currentTest["verdict"] = "pass"
+            self.currentTest["duration"] = round(now - self.currentTest["start"], 3)
+            self.currentTest = None
+            return
+        state = RTEMS_STATE.search(line)
+        if state and self.currentTest:
+            self.currentTest["state"] = state.group(1)
+            return
+        
+        plan = TAP_PLAN.match(line)
+        if plan:
+            self.plan = int(plan.group(1))
+            return
+        result = TAP_RESULT.match(line)
+        if result:
+            if result.group(4):
+                verdict = "skip" if result.group(4).upper() == "SKIP" else "todo"
+            else:
+                verdict = "fail" if result.group(1) else "pass"
+            name = " ".join(g for g in (result.group(2), result.group(3)) if g)
+            test = {"name": name, "verdict": verdict, "start": round(self.lastTapTime, 3), "duration": round(now - self.lastTapTime, 3)}
+            self.tests.append(test)
+            self.numTapResults += 1
+            self.lastTapTime = now
+            self.diagnosticsTest = test if verdict == "fail" else None
+            return
+        if self.diagnosticsTest and (line.startswith("#") or line.startswith(" ")):
+            excerpt = self.diagnosticsTest.setdefault("excerpt", [])
+            if len(excerpt) < EXCERPT_LINES:
+                excerpt.append(line)
+            return
+        self.diagnosticsTest = None
+        
+    #an RTEMS test without END marker failed, the last lines show why
+    def _finishCurrentTest(self, now):
+        if self.currentTest:
+            self.currentTest["duration"] = round(now - self.currentTest["start"], 3)
+            self.currentTest["excerpt"] = list(self.recentLines)
+            self.currentTest = None
+            
+    #result is the result of the request, e.g. success or fail, verdict the
+    #match that ended it
+    def summary(self, result, verdict = None):
+        with self.lock:
+            return self._summary(result, verdict)
+        
+    def _summary(self, result, verdict):
+        now = time.time() - self.startTime
+        if self.partialLine:
+            self._parseLine(self.partialLine.decode(errors = "replace").rstrip("\r"), now)
+            self.partialLine = b""
+        self._finishCurrentTest(now)
+        
+        counts = collections.Counter(test["verdict"] for test in self.tests)
+        summary = {"result": result,
+                   "duration": round(now, 3),
+                   "tests": self.tests,
+                   "passed": counts["pass"],
+                   "failed": counts["fail"],
+                   "skipped": counts["skip"] + counts["todo"]}
+        if verdict:
+            summary["match"] = {"verdict": verdict[0], "pattern": verdict[1]}
+        failed = result != "success" or counts["fail"] > 0
+        #a TAP plan with missing results fails as well
+        if self.plan != None:
+            summary["planned"] = self.plan
+            if self.numTapResults < self.plan:
+                summary["missing"] = self.plan - self.numTapResults
+                failed = True
+        summary["verdict"] = "fail" if failed else "pass"
+        return summary
+    
+    
+#returns a parser if the [Config] section of a client configuration asks for
+#structured results, None otherwise
+def createParser(section):
+    if section.get("resultFormat", "").strip().lower() == JSON:
+        return ResultParser()
+    return None
+
+#one line of JSON, followed by the output of the board if the client asked for the full log
+def render(summary):
+    return json.dumps(summary, sort_keys = True, separators = (",", ":")) + "\n"
@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import io
+import tempfile
+import zlib
+
+DEFAULT_SPOOL_THRESHOLD = 1048576
+CHUNK_SIZE = 65536
+
+def compressedChunks(fileObject, chunkSize = CHUNK_SIZE):
+    compressor = zlib.compressobj()
+    for block in iter(lambda: fileObject.read(chunkSize), b""):
+        chunk = compressor.compress(block)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+#output of a board, kept in memory up to threshold bytes and spooled to a
+#temporary file beyond that
+class SpooledOutput:
+    def __init__(self, threshold = DEFAULT_SPOOL_THRESHOLD, directory = None):
+        self.spool = tempfile.SpooledTemporaryFile(max_size = threshold, dir = directory)
+        self.threshold = threshold
+        self.size = 0
+        
+    #wraps an open binary file that already holds size bytes of output
+    @classmethod
+    def fromFile(cls, fileObject, size):
+        output = cls.__new__(cls)
+        output.spool = fileObject
+        output.threshold = 0
+        output.size = size
+        return output
+        
+    #True if the output lives in a file, whose descriptor can then be passed on
+    def isSpooled(self):
+        return self.size > self.threshold
+    
+    def fileno(self):
+        self.spool.flush()
+        return self.spool.fileno()
+        
+    def write(self, data):
+        self.spool.seek(0, io.SEEK_END)
+        self.spool.write(data)
+        self.size += len(data)
+        
+    def append(self, other):
+        if isinstance(other, SpooledOutput):
+            for chunk in other.chunks():
+                self.write(chunk)
+        else:
+            self.write(str(other).encode())
+        
+    def truncate(self, size):
+        self.spool.truncate(size)
+        self.size = min(self.size, size)
+        
+    def tail(self, numBytes):
+        start = max(self.size - numBytes, 0)
+        self.spool.seek(start)
+        return self.spool.read(self.size - start)
+    
+    def chunks(self, chunkSize = CHUNK_SIZE):
+        position = 0
+        while position < self.size:
+            self.spool.seek(position)
+            chunk = self.spool.read(min(chunkSize, self.size - position))
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+    
+    def compressedChunks(self, chunkSize = CHUNK_SIZE):
+        self.spool.seek(0)
+        return compressedChunks(self.spool, chunkSize)
+    
+    def getvalue(self):
+        self.spool.seek(0)
+        return self.spool.read(self.size).decode(errors = "ignore")
+    
+    def close(self):
+        self.spool.close()
+        
+    def __len__(self):
+        return self.size
+    
+    def __str__(self):
+        return self.getvalue()
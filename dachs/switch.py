@@ -46,7 +46,7 @@ class primitiveTimerThread(threading.Thread):
             time.sleep(1)
         
         if not self.stopRequested:
-            self.mySwitch.switchOff(doseID)
+            self.mySwitch.switchOff(self.doseID)
 
 
 class Netio230BSwitch(https_server.Switch):
@@ -56,6 +56,7 @@ class Netio230BSwitch(https_server.Switch):
         self.primitiveTimer = [None, None, None, None]
         self.name = sectionName
         self.myLock = threading.Lock()
+        self.powered = {}
         
     def configure(self, targetConfiguration):
         self.ipAddress = targetConfiguration.getValue(self.name, "ipAddress")
@@ -87,6 +88,7 @@ class Netio230BSwitch(https_server.Switch):
                 raise https_server.FatalException("This dose ID does not exist")
             
             self.connection.expect(r"250 OK")
+            self.powered[doseID] = True
         print("Successfully switched on dose: " + str(doseID))
     
     def switchOff(self, doseID):
@@ -104,6 +106,7 @@ class Netio230BSwitch(https_server.Switch):
                 raise https_server.FatalException("This dose ID does not exist")
             
             self.connection.expect(r"250 OK")
+            self.powered[doseID] = False
         print("Successfully switched off dose: " + str(doseID))
     
     def restart(self, doseID):
@@ -134,19 +137,25 @@ class Netio230BSwitch(https_server.Switch):
             self.primitiveTimer[doseID].stopRequested = True
             self.primitiveTimer[doseID] = None
             
+    def isPowered(self, doseID):
+        return self.powered.get(doseID, False)
+            
             
 class DummySwitch(https_server.Switch):
     def __init__(self, sectionName):
         print("did init dummySwitch")
+        self.powered = {}
         
     def configure(self, targetConfiguration):  
         print("did configure dummySwitch")
         
     def switchOn(self, doseID):
         print("did switchOn dummySwitch, doseID: " + str(doseID))
+        self.powered[doseID] = True
         
     def switchOff(self, doseID):  
         print("did switchOff dummySwitch, doseID: " + str(doseID))
+        self.powered[doseID] = False
         
     def restart(self, doseID):
         print("did restart dummySwitch, doseID: " + str(doseID))
@@ -156,3 +165,6 @@ class DummySwitch(https_server.Switch):
         
     def stopTimer(self, doseID):
         print("did stopTimer dummySwitch, doseID: " + str(doseID))
+        
+    def isPowered(self, doseID):
+        return self.powered.get(doseID, False)
@@ -24,18 +24,24 @@
 # SUCH DAMAGE.
 
 import abc
-import configparser
 import functools
 import queue
-import re
 import serial
 import subprocess
 import tempfile
 import tftpy
 import threading
 import time
+import zlib
 
+import artifacts
+import diagnostics
+import history
 import https_server
+import metrics
+import patterns
+import results
+import spool
 
 #raddress and rport are just syntactically needed
 def _getFile(index, fileName, raddress, rport):
@@ -43,68 +49,139 @@ def _getFile(index, fileName, raddress, rport):
     print(fileName)
     print("Trying to send data")
     try:
-        imgFile = TQMa7DHandler.IMG_FILE_QUEUE[index].get_nowait()
+        imgFile, labels = TQMa7DHandler.IMG_FILE_QUEUE[index].get_nowait()
         TQMa7DHandler.READ_THREAD_QUEUE_IN[index].put_nowait("Start")
-        return open(imgFile.name,"r+b")
+        #served straight from the artifact, boards sharing an image read the same buffer
+        return TimedFile(imgFile.open(), labels, fileName)
     except queue.Empty:
         return None
+    
+    
+#tftpy reads the file until it is exhausted, the transfer is complete with
+#the last, short block, so the time until then is the transfer time
+class TimedFile:
+    def __init__(self, fileObject, labels, name):
+        self.fileObject = fileObject
+        self.labels = labels
+        self.name = name
+        self.startTime = time.time()
+        self.numBytes = 0
+        
+    def read(self, size = -1):
+        data = self.fileObject.read(size)
+        self.numBytes += len(data)
+        #closed right away, newer tftpy versions flock a file that is still
+        #open when the transfer ends, which needs a descriptor
+        if size < 0 or len(data) < size:
+            self.close()
+        return data
+    
+    #tftpy checks closed before closing the file and needs seek and tell
+    #for the tsize option, e.g. sent by U-Boot
+    @property
+    def closed(self):
+        return self.fileObject.closed
+    
+    def seek(self, offset, whence = 0):
+        return self.fileObject.seek(offset, whence)
+    
+    def tell(self):
+        return self.fileObject.tell()
+    
+    def fileno(self):
+        return self.fileObject.fileno()
+    
+    def close(self):
+        if not self.fileObject.closed:
+            self.fileObject.close()
+            metrics.METRICS.observe("dachs_tftp_seconds", time.time() - self.startTime, **self.labels)
+            metrics.METRICS.increment("dachs_tftp_bytes_total", self.numBytes, **self.labels)
 
    
 class transmitThread(threading.Thread):
     def __init__(self, tftp, tftpTimeout, listenport):
-        threading.Thread.__init__(self)
+        threading.Thread.__init__(self, name = "transmitThread-" + str(listenport))
         self.tftp = tftp
         self.stopRequested = False
         self.tftpTimeout = tftpTimeout
         self.listenport = listenport
         
     def run(self):
+        diagnostics.setContext(tftpPort = self.listenport)
         while True:
             print("starting tftp server")
-            self.tftp.listen(listenport = self.listenport, timeout = self.tftpTimeout)
+            try:
+                self.tftp.listen(listenport = self.listenport, timeout = self.tftpTimeout)
+            except Exception as E:
+                #a failed transfer must not stop serving the board, listen
+                #leaves its socket and sessions behind when it raises
+                print(type(E))
+                print(E)
+                if getattr(self.tftp, "sock", None) != None:
+                    self.tftp.sock.close()
+                self.tftp.sessions = {}
         
         
 class readThread(threading.Thread):
-    END_STRING = []
     SERIAL_READ_TIMEOUT = None
     
-    def __init__(self, clientConfigFileName, index):
-        threading.Thread.__init__(self)
+    def __init__(self, clientConfig, index, labels, spoolThreshold, pathToDir):
+        threading.Thread.__init__(self, name = "readThread-" + str(index))
+        readThread.SERIAL_READ_TIMEOUT = clientConfig["Config"].getint("serialTimeout")
         self.serDev = serial.Serial(port = "/dev/ttyUSB0", baudrate = 115200, timeout = self.SERIAL_READ_TIMEOUT)
-        config = configparser.ConfigParser()
-        config.read(clientConfigFileName)
-        if index >= len(readThread.END_STRING):
-            if index == len(readThread.END_STRING):
-                readThread.END_STRING.append(re.escape(config["Config"]["endString"]))
-            else:
-                raise https_server.FatalException("END_STRING has not the right length")
-        readThread.SERIAL_READ_TIMEOUT = config["Config"].getint("serialTimeout")
         self.stopRequested = False
         self.index = index
+        self.labels = labels
+        self.spoolThreshold = spoolThreshold
+        self.pathToDir = pathToDir
+        #set by the handler for every request before the image is offered
+        self.matcher = None
+        self.resultParser = None
+        self.silenceTimeout = None
         
     def run(self):
+        diagnostics.setContext(**self.labels)
         print("serial thread started")
         while True:
-            currentOutput = self.serDev.read(100).decode(errors = "ignore")
+            currentOutput = self.serDev.read(100)
 
             try:
                 message = TQMa7DHandler.READ_THREAD_QUEUE_IN[self.index].get_nowait()
                 if message == "Start":
                     print("Started now")
-                    while not self.stopRequested and re.search(self.END_STRING[self.index], currentOutput) == None:
-                        currentOutput += self.serDev.read(100).decode(errors = "ignore")
-                        print(currentOutput)
-                        print()
+                    #a stop request only refers to the read that was running when it was made
+                    self.stopRequested = False
+                    matcher = self.matcher
+                    matcher.reset()
+                    resultParser = self.resultParser
+                    if resultParser:
+                        resultParser.reset()
+                    output = spool.SpooledOutput(self.spoolThreshold, self.pathToDir)
+                    output.write(currentOutput)
+                    match = matcher.feed(currentOutput)
+                    self._feedResultParser(resultParser, currentOutput, match, output.size)
+                    lastOutputTime = time.time()
+                    while not self.stopRequested and match == None:
+                        newOutput = self.serDev.read(100)
+                        if newOutput:
+                            lastOutputTime = time.time()
+                        elif self.silenceTimeout and time.time() - lastOutputTime > self.silenceTimeout:
+                            match = patterns.Match(patterns.HANG, "no output for " + str(self.silenceTimeout) + " seconds", output.size)
+                            break
+                        output.write(newOutput)
+                        print(newOutput.decode(errors = "ignore"), end = "")
+                        match = matcher.feed(newOutput)
+                        self._feedResultParser(resultParser, newOutput, match, output.size)
                     
                     if self.stopRequested:
                         print("in stop stopRequested")
                         self.stopRequested = False
-                        currentOutput = None
+                        output.close()
                         self.serDev.reset_input_buffer()
                     else:    
-                        endMatch = re.search(self.END_STRING[self.index], currentOutput)
-                        output = currentOutput[:endMatch.end()]
-                        TQMa7DHandler.READ_THREAD_QUEUE_OUT[self.index].put_nowait(output)
+                        output.truncate(match.end)
+                        metrics.METRICS.increment("dachs_serial_bytes_total", output.size, **self.labels)
+                        TQMa7DHandler.READ_THREAD_QUEUE_OUT[self.index].put_nowait((match, output))
                     
                     
                 else:
@@ -114,31 +191,47 @@ class readThread(threading.Thread):
             
         raise https_server.FatalException("Serdev is closed, should not happen")
         self.serDev.close() 
+        
+    #the output after the match is cut off, the parser must not see it either
+    def _feedResultParser(self, resultParser, data, match, size):
+        if resultParser:
+            if match != None:
+                data = data[:len(data) - (size - match.end)]
+            resultParser.feed(data)
     
 class FileProcessor(abc.ABC):
     @abc.abstractmethod
     def process(self):
         pass
     
+#objcopy and mkimage only work on files, everything in between stays in the
+#artifact store and the image is returned as artifact
 class TQMa7DProcessor(FileProcessor):
-    def __init__(self, testFile, pathToDir):
+    def __init__(self, testFile, artifactStore):
         self.testFile = testFile
-        self.pathToDir = pathToDir
+        self.artifactStore = artifactStore
         
     def process(self):
-        binFile = tempfile.NamedTemporaryFile(suffix = ".bin", delete = True, dir = self.pathToDir)
-        gzFile = tempfile.NamedTemporaryFile(suffix = ".bin.gz", delete = True, dir = self.pathToDir)
-        imgFile = tempfile.NamedTemporaryFile(suffix = ".img", delete = True, dir = self.pathToDir)
+        binFile = tempfile.NamedTemporaryFile(suffix = ".bin", delete = True, dir = self.artifactStore.directory)
+        imgFile = tempfile.NamedTemporaryFile(suffix = ".img", delete = True, dir = self.artifactStore.directory)
         
-        subprocess.call("arm-rtems5-objcopy -O binary " + self.testFile.name + " " + binFile.name, shell = True, timeout = 10)
-        subprocess.call("gzip -9 -f -c " +  binFile.name + " > " + gzFile.name, shell = True, timeout = 10)
-        subprocess.call("mkimage -A arm -O linux -T kernel -a 0x80200000 -e 0x80200000 -n RTEMS -d " + gzFile.name + " " + imgFile.name, shell = True, timeout = 10)
+        subprocess.call("arm-rtems5-objcopy -O binary " + self.testFile.path() + " " + binFile.name, shell = True, timeout = 10)
         
-        self.testFile.close()
+        #same as gzip -9
+        gzFile = self.artifactStore.create(".bin.gz")
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        with open(binFile.name, "rb") as binF:
+            for block in iter(lambda: binF.read(artifacts.CHUNK_SIZE), b""):
+                gzFile.write(compressor.compress(block))
+        gzFile.write(compressor.flush())
         binFile.close()
+        
+        subprocess.call("mkimage -A arm -O linux -T kernel -a 0x80200000 -e 0x80200000 -n RTEMS -d " + gzFile.path() + " " + imgFile.name, shell = True, timeout = 10)
         gzFile.close()
         
-        return imgFile
+        imgArtifact = self.artifactStore.fromFile(imgFile.name, ".img")
+        imgFile.close()
+        return imgArtifact
     
     
 class TQMa7DHandler(https_server.TargetHandler):
@@ -147,24 +240,33 @@ class TQMa7DHandler(https_server.TargetHandler):
     READ_THREAD = []
     READ_THREAD_QUEUE_IN = []
     READ_THREAD_QUEUE_OUT = []
+    CANCEL_POLL_INTERVAL = 0.5
     
-    def __init__(self, testFile, clientConfigFileName, index, targetConfig, sectionName):
+    def __init__(self, testFile, clientConfig, index, targetConfig, sectionName):
         self.testFile = testFile
+        self.cancelled = threading.Event()
         self.targetConfig = targetConfig
         self.sectionName = sectionName
         self.timeout = int(self.targetConfig.getValue(self.sectionName, "transmitTimeout"))
-        self.fileProcessor = TQMa7DProcessor(testFile, self.targetConfig.getValue("httpsServer", "pathToDir"))
+        self.fileProcessor = TQMa7DProcessor(testFile, self.targetConfig.artifactStore)
+        self.imageKey = None
         self.index = index
         self.listenport = int(self.targetConfig.getValue(self.sectionName, "listenport"))
         
-        config = configparser.ConfigParser()
-        config.read(clientConfigFileName)
-        self.clientConfigFileName = clientConfigFileName
-        self.readTimeout = config["Config"].getint("timeout")
+        self.clientConfig = clientConfig
+        self.readTimeout = clientConfig["Config"].getint("timeout")
+        self.matcher = patterns.createMatcher(clientConfig["Config"])
+        self.resultParser = results.createParser(clientConfig["Config"])
+        self.silenceTimeout = clientConfig["Config"].getint("silenceTimeout", fallback = None)
+        self.verdict = None
             
         #"or not" maybe not necessary
         if self.index >= len(TQMa7DHandler.READ_THREAD) or not TQMa7DHandler.READ_THREAD[self.index]:
-            self.readThread = readThread(clientConfigFileName, self.index)
+            spoolThreshold = spool.DEFAULT_SPOOL_THRESHOLD
+            if self.targetConfig.hasValue("httpsServer", "outputSpoolThreshold"):
+                spoolThreshold = int(self.targetConfig.getValue("httpsServer", "outputSpoolThreshold"))
+            self.readThread = readThread(clientConfig, self.index, self.targetConfig.getLabels(self.sectionName),
+                                         spoolThreshold, self.targetConfig.getValue("httpsServer", "pathToDir"))
             
             if len(TQMa7DHandler.READ_THREAD) == index:
                 TQMa7DHandler.READ_THREAD.append(self.readThread)
@@ -207,38 +309,88 @@ class TQMa7DHandler(https_server.TargetHandler):
             print("readThread not yet alive")
             self.readThread.start()
             
-        TQMa7DHandler.IMG_FILE_QUEUE[self.index].put_nowait(self.processedFile)
+        self.readThread.matcher = self.matcher
+        self.readThread.resultParser = self.resultParser
+        self.readThread.silenceTimeout = self.silenceTimeout
+        self.verdict = None
+        TQMa7DHandler.IMG_FILE_QUEUE[self.index].put_nowait((self.processedFile, self.targetConfig.getLabels(self.sectionName)))
         
         print("starting to wait for readThread")
         output = None
-        try:
-            output = TQMa7DHandler.READ_THREAD_QUEUE_OUT[self.index].get(timeout = self.readTimeout)
-        except queue.Empty:
-            print("unsuccessfully generated output")
-            #pass
+        #wait in short steps so that a cancelled request returns quickly
+        deadline = time.time() + self.readTimeout
+        while output == None and not self.cancelled.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                print("unsuccessfully generated output")
+                break
+            try:
+                match, output = TQMa7DHandler.READ_THREAD_QUEUE_OUT[self.index].get(timeout = min(remaining, self.CANCEL_POLL_INTERVAL))
+            except queue.Empty:
+                pass
         print("finished waiting for readThread or timeout")
+        
+        if output != None:
+            self.verdict = (match.verdict, match.pattern)
+            #a hanging board is handled like a timeout, without waiting for it
+            if match.verdict == patterns.HANG:
+                print("board hangs: " + match.pattern)
+                output.close()
+                output = None
         return output
         
+    #boards of this type running the same executable at the same time, e.g. in
+    #a batch run, share one image, which is built once and served to all of them
     def processFile(self):
-        self.processedFile = self.fileProcessor.process()
+        imageKey = (type(self.fileProcessor).__name__, history.hashBuffer(self.testFile.getbuffer()))
+        self.processedFile, savedTime = self.targetConfig.artifactStore.acquireShared(imageKey, self.fileProcessor.process)
+        self.imageKey = imageKey
+        if savedTime != None:
+            print("sharing the image of a concurrent request")
+            labels = self.targetConfig.getLabels(self.sectionName)
+            metrics.METRICS.increment("dachs_image_shares_total", **labels)
+            metrics.METRICS.increment("dachs_image_build_seconds_saved_total", savedTime, **labels)
+            metrics.METRICS.increment("dachs_image_bytes_saved_total", len(self.processedFile), **labels)
         
     def doExit(self):
         print("In TQMa7DHandler doExit")
-        self.processedFile.close()
+        if self.imageKey != None:
+            self.targetConfig.artifactStore.releaseShared(self.imageKey)
+            self.imageKey = None
         print("TQMa7DHandler exit")
         
     def handleTimeout(self):
         print("handling timeout")
         self.readThread.stopRequested = True
         print("handled timeout")
-               
+        
+    def cancel(self):
+        print("cancelling TQMa7DHandler " + str(self.index))
+        self.cancelled.set()
+        #an image the board has not fetched yet must not be served to the next request
+        try:
+            while True:
+                TQMa7DHandler.IMG_FILE_QUEUE[self.index].get_nowait()
+        except queue.Empty:
+            pass
+
+    @classmethod
+    def probe(cls, targetConfig, sectionName):
+        groupKey = (targetConfig.getValue(sectionName, "architecture"), targetConfig.getValue(sectionName, "board"))
+        index = targetConfig.getTargetHandlerGroup(groupKey).sectionNames.index(sectionName)
+        #a read thread that stopped on a closed serial device does not come back
+        if index < len(cls.READ_THREAD) and cls.READ_THREAD[index].ident != None and not cls.READ_THREAD[index].is_alive():
+            return False
+        return True
+
                
 class DummyHandler(https_server.TargetHandler):
-    def __init__(self, testFile, clientConfigFileName, index, targetConfig, sectionName):
+    def __init__(self, testFile, clientConfig, index, targetConfig, sectionName):
         print("dummy with index: " + str(index))
         self.index = index
         self.sectionName = sectionName
         self.targetConfig = targetConfig
+        self.cancelled = threading.Event()
         print(str(self.index) + " with sectionName: " + self.sectionName)
         
     def handleTimeout(self):
@@ -247,11 +399,17 @@ class DummyHandler(https_server.TargetHandler):
     def doExit(self):
         print("dummy "+ str(self.index) + " do Exit")
         
+    def cancel(self):
+        print("dummy " + str(self.index) + " cancel")
+        self.cancelled.set()
+        
     def run(self):
         print("dummy "+ str(self.index) + " running")
-        time.sleep(int(self.targetConfig.getValue(self.sectionName, "runTimeFirstHalf")))
+        if self.cancelled.wait(int(self.targetConfig.getValue(self.sectionName, "runTimeFirstHalf"))):
+            return None
         print("dummy " + str(self.index) + " finished first half")
-        time.sleep(int(self.targetConfig.getValue(self.sectionName, "runTimeSecondHalf")))
+        if self.cancelled.wait(int(self.targetConfig.getValue(self.sectionName, "runTimeSecondHalf"))):
+            return None
         print("dummy " + str(self.index) + " finished running")
         return "success"
 
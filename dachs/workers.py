@@ -0,0 +1,321 @@
+# SPDX-License-Identifier: BSD-2-Clause
+#
+# Copyright (c) 2018 Andreas Dachsberger.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+import concurrent.futures
+import configparser
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.reduction
+import os
+import threading
+import time
+
+import diagnostics
+import history as historyModule
+import https_server
+import metrics
+import spool
+
+#seconds between two metrics snapshots sent by a worker
+METRICS_INTERVAL = 5
+#seconds to wait before a crashed worker is started again
+RESPAWN_DELAY = 5
+#exceptions that keep their type when they cross the process boundary,
+#others arrive as FatalException
+REMOTE_EXCEPTIONS = ("FatalException", "StateMachineException", "RequestCancelledException", "ClientHandlerException")
+
+def _exceptionClass(name):
+    if name in REMOTE_EXCEPTIONS:
+        return getattr(https_server, name)
+    return https_server.FatalException
+
+
+#an artifact in a file is passed by its name, the worker uses the file in
+#place, one in memory is passed by value
+def _sendableArtifact(artifact):
+    if artifact.isSpooled():
+        return ("file", artifact.path())
+    return ("bytes", artifact.getbuffer().tobytes())
+
+def _receiveArtifact(artifactStore, sendable):
+    if sendable[0] == "file":
+        return artifactStore.wrapFile(sendable[1])
+    return artifactStore.fromBytes(sendable[1])
+
+
+#groups sharing a switch have to live in the same worker, as every switch is
+#driven by exactly one process, the largest sets of groups are placed first,
+#each one into the worker with the fewest boards
+def shardGroups(targetConfig, numWorkers):
+    components = []
+    for key in targetConfig.getTargetHandlerGroupKeys():
+        keys = {key}
+        switchNames = set(targetConfig.getSwitchNames(key))
+        for component in [c for c in components if c[1] & switchNames]:
+            components.remove(component)
+            keys |= component[0]
+            switchNames |= component[1]
+        components.append((keys, switchNames))
+    
+    def numBoards(keys):
+        return sum(len(targetConfig.getTargetHandlerGroup(k).sectionNames) for k in keys)
+    
+    shards = [[] for i in range(min(numWorkers, len(components)))]
+    for keys, switchNames in sorted(components, key = lambda c: -numBoards(c[0])):
+        shard = min(shards, key = numBoards)
+        shard.extend(sorted(keys))
+    return shards
+
+
+#entry point of a worker process, it drives the boards and switches of its
+#groups and runs the requests the frontend dispatches to them
+def workerMain(connection, configFileName, groupKeys):
+    targetConfig = https_server.TargetConfiguration(configFileName, groupKeys)
+    #the thread dump and profiler of a worker are triggered by signalling its pid
+    diagnostics.installSignalHandlers(targetConfig.getValue("httpsServer", "pathToDir"))
+    switchNames = set()
+    for key in targetConfig.getTargetHandlerGroupKeys():
+        switchNames.update(targetConfig.getSwitchNames(key))
+    targetConfig.setSwitches(https_server.initializeSwitch(targetConfig, switchNames))
+    if targetConfig.hasValue("httpsServer", "historyFile"):
+        targetConfig.setHistory(historyModule.RunHistory(targetConfig.getValue("httpsServer", "historyFile")))
+    
+    Worker(connection, targetConfig).serve()
+    
+    
+class Worker:
+    def __init__(self, connection, targetConfig):
+        self.connection = connection
+        self.targetConfig = targetConfig
+        self.sendLock = threading.Lock()
+        self.cancelTokens = {}
+        
+    def serve(self):
+        metricsThread = threading.Thread(target = self._sendMetrics)
+        metricsThread.daemon = True
+        metricsThread.start()
+        
+        while True:
+            try:
+                message = self.connection.recv()
+            except EOFError:
+                #the frontend is gone
+                break
+            if message[0] == "run":
+                requestID = message[1]
+                self.cancelTokens[requestID] = https_server.CancelToken()
+                requestThread = threading.Thread(target = self._run, args = message[1:])
+                requestThread.daemon = True
+                requestThread.start()
+            elif message[0] == "cancel":
+                cancelToken = self.cancelTokens.get(message[1])
+                if cancelToken:
+                    cancelToken.cancel()
+                    
+    def _run(self, requestID, groupKey, executable, clientConfig, exeHash):
+        fileInput = None
+        diagnostics.setContext(workerRequest = requestID, architecture = groupKey[0], board = groupKey[1])
+        try:
+            group = self.targetConfig.getTargetHandlerGroup(groupKey)
+            fileInput = _receiveArtifact(self.targetConfig.artifactStore, executable)
+            config = configparser.ConfigParser(interpolation = None)
+            config.read_dict(clientConfig)
+            output, result = group.handle(fileInput, config, exeHash, self.cancelTokens[requestID])
+            self._sendOutput(requestID, output, result)
+        except Exception as E:
+            print(type(E))
+            print(E)
+            self._send(("error", requestID, type(E).__name__, str(E)))
+        finally:
+            self.cancelTokens.pop(requestID, None)
+            if fileInput != None:
+                fileInput.close()
+            diagnostics.clearContext()
+            
+    #outputs that were spooled to a file are passed as file descriptor, the
+    #frontend reads the same file without copying it through the pipe
+    def _sendOutput(self, requestID, output, result):
+        with self.sendLock:
+            self.connection.send(("metrics", metrics.METRICS.snapshot()))
+            if isinstance(output, spool.SpooledOutput):
+                try:
+                    if output.isSpooled():
+                        self.connection.send(("file", requestID, result, len(output)))
+                        multiprocessing.reduction.send_handle(self.connection, output.fileno(), os.getppid())
+                    else:
+                        self.connection.send(("output", requestID, result, output.tail(len(output))))
+                finally:
+                    output.close()
+            else:
+                self.connection.send(("output", requestID, result, output))
+                
+    def _send(self, message):
+        with self.sendLock:
+            self.connection.send(message)
+            
+    def _sendMetrics(self):
+        while True:
+            time.sleep(METRICS_INTERVAL)
+            try:
+                self._send(("metrics", metrics.METRICS.snapshot()))
+            except OSError:
+                return
+    
+    
+#the frontend's end of a worker process, it restarts the process if it crashes
+class WorkerHandle:
+    def __init__(self, workerID, configFileName, groupKeys):
+        self.workerID = workerID
+        self.configFileName = configFileName
+        self.groupKeys = groupKeys
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.requestIDs = itertools.count()
+        self.connection = None
+        self.process = None
+        
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        connection, childConnection = context.Pipe()
+        process = context.Process(target = workerMain, args = (childConnection, self.configFileName, self.groupKeys))
+        process.daemon = True
+        process.start()
+        childConnection.close()
+        with self.lock:
+            self.connection = connection
+            self.process = process
+        print("worker " + str(self.workerID) + " (pid " + str(process.pid) + ") serves " + str(self.groupKeys))
+        
+        receiveThread = threading.Thread(target = self._receive, args = (connection,))
+        receiveThread.daemon = True
+        receiveThread.start()
+        
+    def submit(self, groupKey, executable, clientConfig, exeHash):
+        future = concurrent.futures.Future()
+        executable = _sendableArtifact(executable)
+        clientConfig = dict((section, dict(clientConfig.items(section, raw = True))) for section in clientConfig.sections())
+        with self.lock:
+            requestID = next(self.requestIDs)
+            try:
+                self.connection.send(("run", requestID, groupKey, executable, clientConfig, exeHash))
+            except OSError:
+                raise https_server.FatalException("Worker " + str(self.workerID) + " is not available")
+            self.pending[requestID] = future
+        return (requestID, future)
+    
+    def cancel(self, requestID):
+        with self.lock:
+            if requestID in self.pending:
+                try:
+                    self.connection.send(("cancel", requestID))
+                except OSError:
+                    pass
+                
+    def _receive(self, connection):
+        while True:
+            try:
+                message = connection.recv()
+                if message[0] == "file":
+                    fd = multiprocessing.reduction.recv_handle(connection)
+            except (EOFError, OSError):
+                break
+            
+            if message[0] == "metrics":
+                metrics.METRICS.mergeSnapshot(self.workerID, message[1])
+                continue
+            with self.lock:
+                future = self.pending.pop(message[1], None)
+            if future == None:
+                if message[0] == "file":
+                    os.close(fd)
+                continue
+            if message[0] == "file":
+                output = spool.SpooledOutput.fromFile(os.fdopen(fd, "r+b"), message[3])
+                future.set_result((output, message[2]))
+            elif message[0] == "output":
+                output = message[3]
+                if isinstance(output, bytes):
+                    output = spool.SpooledOutput()
+                    output.write(message[3])
+                future.set_result((output, message[2]))
+            elif message[0] == "error":
+                future.set_exception(_exceptionClass(message[2])(message[3]))
+                
+        self._restart()
+        
+    def _restart(self):
+        with self.lock:
+            failed = self.pending
+            self.pending = {}
+            process = self.process
+        process.join(1)
+        print("worker " + str(self.workerID) + " exited with " + str(process.exitcode) + ", " + str(len(failed)) + " requests lost")
+        for future in failed.values():
+            future.set_exception(https_server.FatalException("Worker " + str(self.workerID) + " crashed while handling the request"))
+        metrics.METRICS.retireSnapshot(self.workerID)
+        metrics.METRICS.increment("dachs_worker_restarts_total", worker = self.workerID)
+        
+        time.sleep(RESPAWN_DELAY)
+        self.start()
+        
+        
+#stands in for a TargetHandlerGroup owned by a worker process
+class RemoteTargetHandlerGroup:
+    def __init__(self, worker, groupKey, sectionNames):
+        self.worker = worker
+        self.groupKey = groupKey
+        self.sectionNames = sectionNames
+        
+    def handle(self, fileInput, clientConfig, exeHash = None, cancelToken = None):
+        if not cancelToken:
+            cancelToken = https_server.CancelToken()
+        requestID, future = self.worker.submit(self.groupKey, fileInput, clientConfig, exeHash)
+        cancel = functools.partial(self.worker.cancel, requestID)
+        cancelToken.addCallback(cancel)
+        try:
+            return future.result()
+        finally:
+            cancelToken.removeCallback(cancel)
+            
+            
+class WorkerPool:
+    def __init__(self, configFileName, targetConfig, numWorkers):
+        self.targetConfig = targetConfig
+        self.workers = []
+        for workerID, groupKeys in enumerate(shardGroups(targetConfig, numWorkers)):
+            self.workers.append(WorkerHandle(workerID, configFileName, groupKeys))
+            
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+            
+    def getTargetHandlerGroups(self):
+        groups = {}
+        for worker in self.workers:
+            for key in worker.groupKeys:
+                groups[key] = RemoteTargetHandlerGroup(worker, key, self.targetConfig.getTargetHandlerGroup(key).sectionNames)
+        return groups